@@ -0,0 +1,372 @@
+"""
+Throughput and latency benchmark of the auth, users and posts endpoints.
+
+Seeds the database (benchmarks/seed.py), then sends `--requests` requests per
+endpoint, `--concurrency` at a time, either through the Flask test client
+(in-process, with mongomock or MongoDB) or over HTTP to a multi-worker
+gunicorn (needs a real MongoDB, reachable with the MONGO_* settings, and a
+Redis at --redis-url shared by the workers for revoked tokens and rate
+limits). Prints p50/p95/p99 latency, requests per second and RSS per
+endpoint as JSON.
+
+    python -m benchmarks.run --mongo mongomock --out results.json
+    python -m benchmarks.run --mode gunicorn --workers 3 --drop --out results.json
+    python -m benchmarks.run --mongo mongomock --baseline benchmarks/baseline.json
+
+With --baseline the results are compared to a stored run: an endpoint whose
+p95 grew, or whose throughput fell, by more than --tolerance is a regression
+and the exit status is 1. --save-baseline stores the run instead.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    import psutil
+except ImportError:  # pragma: no cover
+    psutil = None
+
+
+# Drivers: send one request and return its status code.
+
+
+class ClientDriver:
+    """The Flask test client, one per thread."""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+        self.pids = [os.getpid()]
+
+    def request(self, method, path, headers=None, json=None):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        return client.open(path, method=method, headers=headers, json=json).status_code
+
+    def close(self):
+        pass
+
+
+class GunicornDriver:
+    """gunicorn serving manage:app on localhost, one requests.Session per thread."""
+
+    def __init__(self, workers, threads, port, redis_url):
+        import requests
+
+        self._requests = requests
+        self._local = threading.local()
+        self.base_url = f"http://127.0.0.1:{port}"
+        self.process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "gunicorn",
+                "--workers",
+                str(workers),
+                "--threads",
+                str(threads),
+                "--bind",
+                f"127.0.0.1:{port}",
+                "manage:app",
+            ],
+            cwd=ROOT,
+            # gunicorn.conf.py refuses several workers without a shared denylist
+            env=dict(
+                os.environ,
+                MONGO_ENSURE_INDEXES="false",
+                REVOCATION_BACKEND="redis",
+                REVOCATION_REDIS_URL=redis_url,
+                RATELIMIT_BACKEND="redis",
+                RATELIMIT_REDIS_URL=redis_url,
+            ),
+        )
+        self._wait_ready()
+
+    def _wait_ready(self, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                sys.exit("gunicorn exited during startup")
+            try:
+                self._requests.get(f"{self.base_url}/health", timeout=1)
+                return
+            except self._requests.ConnectionError:
+                time.sleep(0.2)
+        self.close()
+        sys.exit("gunicorn did not start")
+
+    @property
+    def pids(self):
+        if psutil is None:
+            return [self.process.pid]
+        parent = psutil.Process(self.process.pid)
+        return [parent.pid] + [child.pid for child in parent.children(recursive=True)]
+
+    def request(self, method, path, headers=None, json=None):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+        return session.request(
+            method, self.base_url + path, headers=headers, json=json
+        ).status_code
+
+    def close(self):
+        self.process.terminate()
+        self.process.wait(10)
+
+
+# Scenarios: name -> function(context, i) returning (method, path, headers, json).
+
+
+def _auth(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+def _login(ctx, i):
+    from benchmarks.seed import BENCH_PASSWORD, bench_email
+
+    body = {"email": bench_email(i % ctx["users"]), "password": BENCH_PASSWORD}
+    return "POST", "/auth/login", None, body
+
+
+def _authenticate(ctx, i):
+    return (
+        "GET",
+        "/auth/authenticate",
+        _auth(ctx["tokens"][i % len(ctx["tokens"])]),
+        None,
+    )
+
+
+def _list_users(ctx, i):
+    return "GET", "/users/?limit=20", _auth(ctx["tokens"][0]), None
+
+
+def _user_posts(ctx, i):
+    user_id = ctx["user_ids"][i % len(ctx["user_ids"])]
+    return "GET", f"/users/{user_id}/posts?limit=20", _auth(ctx["tokens"][0]), None
+
+
+def _list_posts(ctx, i):
+    return "GET", "/posts/?limit=20", None, None
+
+
+def _update_post(ctx, i):
+    post_id = ctx["update_ids"][i % len(ctx["update_ids"])]
+    body = {"title": f"Updated {i}"}
+    return "PUT", f"/posts/{post_id}", _auth(ctx["admin_token"]), body
+
+
+def _delete_post(ctx, i):
+    # Every delete needs a post of its own; past the reserved ones they 404.
+    post_id = ctx["delete_ids"][i] if i < len(ctx["delete_ids"]) else "missing"
+    return "DELETE", f"/posts/{post_id}", _auth(ctx["admin_token"]), None
+
+
+SCENARIOS = {
+    "POST /auth/login": _login,
+    "GET /auth/authenticate": _authenticate,
+    "GET /users/": _list_users,
+    "GET /users/{id}/posts": _user_posts,
+    "GET /posts/": _list_posts,
+    "PUT /posts/{id}": _update_post,
+    "DELETE /posts/{id}": _delete_post,
+}
+
+
+def rss_mb(pids):
+    if psutil is None:
+        import resource
+
+        # Peak, not current, RSS of this process (KiB on Linux).
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    total = 0
+    for pid in pids:
+        try:
+            total += psutil.Process(pid).memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    return round(total / 2**20, 1)
+
+
+def run_scenario(driver, scenario, ctx, requests, concurrency):
+    def timed_request(i):
+        method, path, headers, body = scenario(ctx, i)
+        started = time.perf_counter()
+        status = driver.request(method, path, headers=headers, json=body)
+        return time.perf_counter() - started, status
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(timed_request, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(1000 * latency for latency, _ in results)
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "requests": requests,
+        "errors": sum(1 for _, status in results if status >= 400),
+        "p50_ms": round(cuts[49], 3),
+        "p95_ms": round(cuts[94], 3),
+        "p99_ms": round(cuts[98], 3),
+        "rps": round(requests / elapsed, 1),
+        "rss_mb": rss_mb(driver.pids),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Per endpoint change of p95 and rps against `baseline`."""
+    comparison = {}
+    for name, current in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            continue
+        p95_change = current["p95_ms"] / previous["p95_ms"] - 1
+        rps_change = current["rps"] / previous["rps"] - 1
+        comparison[name] = {
+            "p95_change": round(p95_change, 3),
+            "rps_change": round(rps_change, 3),
+            "regressed": p95_change > tolerance or rps_change < -tolerance,
+        }
+    return comparison
+
+
+def setup(args):
+    if args.mongo == "mongomock":
+        import flask_pymongo
+        import mongomock
+
+        flask_pymongo.MongoClient = lambda *a, **kw: mongomock.MongoClient()
+
+    from benchmarks.seed import BENCH_PASSWORD, bench_email, seed
+
+    # Measure the endpoints, not the login rate limiter.
+    os.environ.setdefault("RATELIMIT_ENABLED", "false")
+    from project import create_app, mongo
+
+    app = create_app()
+    with app.app_context():
+        users = seed(args.users, args.posts, drop=True)
+        post_ids = [
+            p["post_id"]
+            for p in mongo.db.posts.find({}, {"post_id": 1}).limit(2 * args.requests)
+        ]
+    client = app.test_client()
+    tokens = []
+    for i in range(min(args.users, args.tokens)):
+        response = client.post(
+            "/auth/login",
+            json={"email": bench_email(i), "password": BENCH_PASSWORD},
+        )
+        tokens.append(response.get_json()["auth_token"])
+    ctx = {
+        "users": args.users,
+        "user_ids": [user["user_id"] for user in users],
+        "tokens": tokens,
+        "admin_token": tokens[0],
+        "update_ids": post_ids[: args.requests],
+        "delete_ids": post_ids[args.requests :],
+    }
+    return app, ctx
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n")[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--mode", choices=["client", "gunicorn"], default="client")
+    parser.add_argument("--mongo", choices=["mongomock", "mongodb"], default="mongodb")
+    parser.add_argument(
+        "--drop",
+        action="store_true",
+        help="allow emptying users/posts of a real MongoDB",
+    )
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--posts", type=int, default=2000)
+    parser.add_argument(
+        "--tokens",
+        type=int,
+        default=10,
+        help="users logged in up front for authenticated requests",
+    )
+    parser.add_argument("--requests", type=int, default=500, help="per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument(
+        "--redis-url",
+        default=os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0"),
+        help="Redis shared by the gunicorn workers",
+    )
+    parser.add_argument("--only", action="append", choices=sorted(SCENARIOS))
+    parser.add_argument("--out", help="write the JSON report to this file")
+    parser.add_argument("--baseline", help="compare with this stored report")
+    parser.add_argument("--save-baseline", help="store this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.mongo == "mongodb" and not args.drop:
+        sys.exit("Seeding empties users and posts; pass --drop to confirm.")
+    if args.mode == "gunicorn" and args.mongo == "mongomock":
+        sys.exit("gunicorn workers cannot share mongomock; use --mongo mongodb.")
+    if args.users < 1 or args.posts < 1 or args.requests < 2:
+        sys.exit("Need at least 1 user, 1 post and 2 requests per endpoint.")
+
+    app, ctx = setup(args)
+    if args.mode == "gunicorn":
+        driver = GunicornDriver(args.workers, args.threads, args.port, args.redis_url)
+    else:
+        driver = ClientDriver(app)
+    try:
+        results = {
+            name: run_scenario(driver, scenario, ctx, args.requests, args.concurrency)
+            for name, scenario in SCENARIOS.items()
+            if not args.only or name in args.only
+        }
+    finally:
+        driver.close()
+
+    report = {
+        "meta": {
+            "mode": args.mode,
+            "mongo": args.mongo,
+            "users": args.users,
+            "posts": args.posts,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "workers": args.workers if args.mode == "gunicorn" else 1,
+            "bcrypt_rounds": app.config["BCRYPT_LOG_ROUNDS"],
+            "python": platform.python_version(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    regressed = False
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["comparison"] = compare(results, json.load(f), args.tolerance)
+        regressed = any(c["regressed"] for c in report["comparison"].values())
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    for path in filter(None, (args.out, args.save_baseline)):
+        with open(path, "w") as f:
+            f.write(output + "\n")
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Seed the users and posts collections with benchmark data.
+
+Every user is `bench<i>@example.com` / `bench<i>` with password BENCH_PASSWORD;
+posts are spread evenly over the users. Documents are built by the same
+helpers as the API, so they have the production shape.
+
+    MONGO_SERVER_NAME=localhost python -m benchmarks.seed --users 1000 --posts 20000 --drop
+
+--drop empties the users and posts collections of the configured database
+first; never point it at a database you care about.
+"""
+
+import argparse
+
+from project import hashing, mongo
+from project.cruds import _new_post, _new_user
+from project.indexes import ensure_indexes
+
+BENCH_PASSWORD = "bench-password"
+BATCH_SIZE = 1000
+
+
+def bench_email(i):
+    return f"bench{i}@example.com"
+
+
+def seed(users=100, posts=1000, admins=1, drop=False):
+    """
+    Insert `users` users (the first `admins` of them admins) and `posts`
+    posts. Must run inside an app context. Returns the inserted users.
+    """
+    db = mongo.db
+    if drop:
+        db.users.drop()
+        db.posts.drop()
+    ensure_indexes(db)
+    # One hash for everybody: seeding should not cost a bcrypt per user.
+    hashed_password = hashing.generate_password_hash(BENCH_PASSWORD)
+    docs = [
+        _new_user(
+            bench_email(i),
+            f"bench{i}",
+            "admin" if i < admins else "user",
+            hashed_password,
+        )
+        for i in range(users)
+    ]
+    for start in range(0, len(docs), BATCH_SIZE):
+        db.users.insert_many(docs[start : start + BATCH_SIZE])
+    batch = []
+    for i in range(posts):
+        user = docs[i % users]
+        batch.append(_new_post(user["email"], user["username"], f"Post {i}"))
+        if len(batch) == BATCH_SIZE:
+            db.posts.insert_many(batch)
+            batch = []
+    if batch:
+        db.posts.insert_many(batch)
+    return docs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed benchmark data.")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--posts", type=int, default=1000)
+    parser.add_argument(
+        "--drop", action="store_true", help="empty the collections first"
+    )
+    args = parser.parse_args()
+
+    from project import create_app
+
+    with create_app().app_context():
+        seed(args.users, args.posts, drop=args.drop)
+    print(f"Seeded {args.users} users and {args.posts} posts")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""
+gunicorn settings picked up from the working directory.
+
+With PROMETHEUS_MULTIPROC_DIR set, every worker writes its metrics to that
+directory and /metrics aggregates them; the hooks below empty it on start
+and drop the files of workers that exited.
+
+Startup is refused when several workers would each keep their own token
+denylist, since a logout would then only apply to one of them.
+"""
+
+import os
+import shutil
+
+multiproc_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+
+def on_starting(server):
+    # read like project.config does, without importing the app in the master
+    backend = os.environ.get("REVOCATION_BACKEND", "local")
+    if server.cfg.workers > 1 and backend != "redis":
+        raise RuntimeError(
+            f"{server.cfg.workers} workers with REVOCATION_BACKEND={backend!r}: "
+            "revoked tokens would stay valid in the other workers, "
+            "set REVOCATION_BACKEND=redis"
+        )
+    if multiproc_dir:
+        shutil.rmtree(multiproc_dir, ignore_errors=True)
+        os.makedirs(multiproc_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    if multiproc_dir:
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
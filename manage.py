@@ -1,12 +1,31 @@
-from aws_lambda_wsgi import response
+import os
+
 from project import create_app
-app = create_app()
+
+ON_LAMBDA = "AWS_LAMBDA_FUNCTION_NAME" in os.environ
+if ON_LAMBDA:
+    os.environ.setdefault("APP_SETTINGS", "project.config.LambdaConfig")
+
+# On Lambda the app (and its Mongo client) is built by the first invocation
+# and then reused by every warm invocation of the same container.
+app = None if ON_LAMBDA else create_app()
+
+
+def get_app():
+    global app
+    if app is None:
+        app = create_app()
+    return app
+
 
 def lambda_handler(event, context):
     """
     Lambda handler that will handle the API Gateway events
     """
-    return response(app, event, context)
+    from aws_lambda_wsgi import response
+
+    return response(get_app(), event, context)
+
 
-if "__name__" == "__main__":
-    app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
+if __name__ == "__main__":
+    get_app().run(host="0.0.0.0", port=5000)
@@ -1,4 +1,3 @@
-import logging
 import os
 
 from flask import Flask
@@ -6,9 +5,22 @@ from flask_bcrypt import Bcrypt
 from flask_cors import CORS
 from flask_pymongo import PyMongo
 
+from project.caching import Cache, Denylist, TTLCache
+from project.hashing import HashingPool
+from project.jobs import DeletionWorker
+from project.keys import KeyRing
+from project.ratelimit import RateLimiter
+
 cors = CORS()
 bcrypt = Bcrypt()
 mongo = PyMongo()
+hashing = HashingPool()
+cache = Cache()
+token_cache = TTLCache()
+denylist = Denylist()
+keyring = KeyRing()
+limiter = RateLimiter()
+deletions = DeletionWorker()
 
 
 def create_app():
@@ -17,17 +29,51 @@ def create_app():
 
         app_settings = os.environ.get("APP_SETTINGS", "project.config.BaseConfig")
         app.config.from_object(app_settings)
-        app.logger.setLevel(logging.INFO)
-        mongo.init_app(app)
+        from project import log
+
+        log.init_app(app)
+
+        from project.database import client_options
+
+        mongo.init_app(app, **client_options(app.config))
+        if app.config["PROXY_FIX_X_FOR"]:
+            from werkzeug.middleware.proxy_fix import ProxyFix
+
+            app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["PROXY_FIX_X_FOR"])
         cors.init_app(app)
         bcrypt.init_app(app)
+        hashing.init_app(app)
+        cache.init_app(app)
+        token_cache.configure(
+            app.config["TOKEN_CACHE_SIZE"], app.config["TOKEN_CACHE_TTL"]
+        )
+        denylist.init_app(app)
+        keyring.init_app(app)
+        limiter.init_app(app)
+        deletions.init_app(app)
 
+        from project import metrics
         from project.apis import api
+        from project.counters import db_reconcile_counters_command
+        from project.indexes import db_indexes_command, init_indexes
+        from project.jobs import deletion_worker_command
+        from project.keys import jwt_keygen_command
+        from project.search import db_backfill_search_command
+
+        # The spec is built on the first /swagger.json request, not here.
+        api.init_app(app, add_specs=app.config["API_DOCS"])
+        metrics.init_app(app)
+        init_indexes(app)
+        app.cli.add_command(db_indexes_command)
+        app.cli.add_command(jwt_keygen_command)
+        app.cli.add_command(db_backfill_search_command)
+        app.cli.add_command(db_reconcile_counters_command)
+        app.cli.add_command(deletion_worker_command)
 
-        api.init_app(app)
+        if app.config["SHELL_CONTEXT"]:
 
-        @app.shell_context_processor
-        def ctx():
-            return {"app": app}
+            @app.shell_context_processor
+            def ctx():
+                return {"app": app}
 
         return app
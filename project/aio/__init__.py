@@ -0,0 +1,20 @@
+"""
+Native asyncio serving mode.
+
+create_asgi_app() returns an ASGI application serving the auth, users and
+posts endpoints with async handlers on Motor, so one process can hold
+thousands of concurrent connections while waiting on MongoDB and bcrypt.
+The WSGI app from project.create_app() stays available; the bulk, export
+and HATEOAS endpoints and the Swagger UI are only served there.
+"""
+
+
+def create_asgi_app():
+    from project import create_app
+
+    flask_app = create_app()
+
+    from project.aio.app import AsgiApp
+    from project.aio.handlers import routes
+
+    return AsgiApp(flask_app, routes)
@@ -0,0 +1,220 @@
+import json
+import re
+from functools import wraps
+from urllib.parse import parse_qs
+
+from project import deletions
+from project.aio import cruds
+from project.aio.blocking import offload
+from project.decorator import Principal
+from project.hashing import HashingBusy
+from project.ratelimit import RateLimited
+from project.serialization import dumps
+from project.utils import decode_auth_token, decode_cursor
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+class Request:
+    """The parts of an ASGI HTTP request the handlers need."""
+
+    def __init__(self, scope, body, params, config):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.headers = {
+            key.decode("latin-1").lower(): value.decode("latin-1")
+            for key, value in scope.get("headers", [])
+        }
+        self.client = self._client(
+            (scope.get("client") or (None,))[0], config["PROXY_FIX_X_FOR"]
+        )
+        query = parse_qs(scope.get("query_string", b"").decode())
+        self.args = {key: values[-1] for key, values in query.items()}
+        self.params = params
+        self.config = config
+        self.principal = None
+        self._body = body
+
+    def _client(self, peer, trusted):
+        # Same as werkzeug's ProxyFix(x_for=trusted): the address the first
+        # trusted proxy saw, counted from the right of X-Forwarded-For.
+        forwarded = [
+            value.strip()
+            for value in self.headers.get("x-forwarded-for", "").split(",")
+            if value.strip()
+        ]
+        if trusted and len(forwarded) >= trusted:
+            return forwarded[-trusted]
+        return peer
+
+    def json(self):
+        try:
+            data = json.loads(self._body or b"{}")
+        except ValueError:
+            raise HTTPError(400, "Invalid JSON body")
+        if not isinstance(data, dict):
+            raise HTTPError(400, "Invalid JSON body")
+        return data
+
+    def page_args(self):
+        """Same as project.utils.get_page_args."""
+        try:
+            limit = int(self.args.get("limit", self.config["PAGE_SIZE_DEFAULT"]))
+            cursor = self.args.get("next")
+            cursor = decode_cursor(cursor) if cursor else None
+        except ValueError:
+            raise HTTPError(400, "Invalid limit or cursor")
+        return max(1, min(limit, self.config["PAGE_SIZE_MAX"])), cursor
+
+
+def token_required(handler):
+    """Async counterpart of project.decorator.token_required."""
+
+    @wraps(handler)
+    async def decorated(request):
+        auth_token = request.headers.get("authorization")
+        if not auth_token:
+            raise HTTPError(401, "Token Required")
+        parts = auth_token.split(" ")
+        if len(parts) != 2:
+            raise HTTPError(401, "Invalid Token")
+        payload = await offload(decode_auth_token, parts[1])
+        if payload == "expired":
+            raise HTTPError(401, "Expired Token")
+        elif payload == "invalid":
+            raise HTTPError(401, "Invalid Token")
+        elif payload == "revoked":
+            raise HTTPError(401, "Revoked Token")
+        request.principal = Principal(payload)
+        return await handler(request)
+
+    return decorated
+
+
+class AsgiApp:
+    """
+    Minimal ASGI application: a route table of async handlers, run inside
+    the Flask app context so that config, logging and the token helpers
+    work as in the WSGI app. Flask contexts live in contextvars, so each
+    request task gets its own.
+    """
+
+    def __init__(self, flask_app, routes):
+        self.flask_app = flask_app
+        # Patterns in the order of `routes`, each with its {method: handler}:
+        # the first pattern matching a path owns it, so PUT /users/search is
+        # a 405 and not an update of the user "search".
+        by_pattern = {}
+        for method, pattern, handler in routes:
+            by_pattern.setdefault(pattern, {})[method] = handler
+        self.routes = [
+            (self._compile(pattern), handlers)
+            for pattern, handlers in by_pattern.items()
+        ]
+
+    @staticmethod
+    def _compile(pattern):
+        regex = re.sub(r"{(\w+)}", r"(?P<\1>[^/]+)", pattern.rstrip("/"))
+        return re.compile(f"^{regex}/?$")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            limit = self.flask_app.config["MAX_CONTENT_LENGTH"]
+            try:
+                body = await self._read_body(scope, receive, limit)
+            except HTTPError as e:
+                await self._respond(send, e.status, {"message": e.message}, e.headers)
+                return
+            status, payload, headers = await self._dispatch(scope, body)
+            await self._respond(send, status, payload, headers)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                cruds.init_db(self.flask_app)
+                deletions.start()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                cruds.close_db()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    @staticmethod
+    async def _read_body(scope, receive, limit):
+        """The request body; HTTPError 413 past `limit` bytes, like Flask."""
+        too_large = HTTPError(413, "Request Entity Too Large")
+        for key, value in scope.get("headers", []):
+            if key.lower() == b"content-length" and value.isdigit():
+                if limit is not None and int(value) > limit:
+                    raise too_large
+        chunks, size = [], 0
+        while True:
+            message = await receive()
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if limit is not None and size > limit:
+                raise too_large
+            chunks.append(chunk)
+            if not message.get("more_body"):
+                return b"".join(chunks)
+
+    async def _dispatch(self, scope, body):
+        path = scope["path"]
+        for regex, handlers in self.routes:
+            match = regex.match(path)
+            if match:
+                break
+        else:
+            return 404, {"message": "Not Found"}, {}
+        handler = handlers.get(scope["method"])
+        if handler is None:
+            return (
+                405,
+                {"message": "Method Not Allowed"},
+                {"Allow": ", ".join(sorted(handlers))},
+            )
+        with self.flask_app.app_context():
+            cruds.init_db(self.flask_app)
+            request = Request(scope, body, match.groupdict(), self.flask_app.config)
+            try:
+                result = await handler(request)
+            except HTTPError as e:
+                return e.status, {"message": e.message}, e.headers
+            except RateLimited as e:
+                return (
+                    429,
+                    {"message": "Too many attempts, please retry later."},
+                    {"Retry-After": str(e.retry_after)},
+                )
+            except HashingBusy as e:
+                return (
+                    503,
+                    {"message": "Server is busy, please retry later."},
+                    {"Retry-After": str(e.retry_after)},
+                )
+            except Exception:
+                self.flask_app.logger.exception("Unhandled error on %s", path)
+                return 500, {"message": "Internal Server Error"}, {}
+        payload, status, *headers = result
+        return status, payload, headers[0] if headers else {}
+
+    @staticmethod
+    async def _respond(send, status, payload, headers):
+        body = b"" if status in (204, 304) else dumps(payload)
+        raw_headers = [(b"content-type", b"application/json")]
+        raw_headers += [
+            (k.lower().encode(), str(v).encode()) for k, v in headers.items()
+        ]
+        await send(
+            {"type": "http.response.start", "status": status, "headers": raw_headers}
+        )
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,31 @@
+"""
+The denylist, the rate limiter and the document cache are sync and, with
+a Redis backend, wait on a network round trip. The async handlers call
+them through offload() so that the event loop keeps serving meanwhile.
+"""
+
+import asyncio
+from functools import partial
+
+from flask import current_app as app
+
+
+def _uses_redis(config):
+    return "redis" in (
+        config["REVOCATION_BACKEND"],
+        config["RATELIMIT_BACKEND"],
+        config["CACHE_BACKEND"],
+    )
+
+
+async def offload(fn, *args, **kwargs):
+    """
+    Call `fn` in the default executor when a Redis backend is configured;
+    inline otherwise, as the in-process stores answer faster than a thread
+    hop would.
+    """
+    if not _uses_redis(app.config):
+        return fn(*args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(
+        None, partial(fn, *args, **kwargs)
+    )
@@ -0,0 +1,288 @@
+"""
+Async counterparts of project.cruds on Motor, for the ASGI serving mode.
+
+Queries, projections and update documents are built by the same helpers as
+the sync layer, so both modes read and write identical documents.
+"""
+
+from datetime import datetime
+
+from pymongo import ReturnDocument
+
+from project import cache
+from project.aio.blocking import offload
+from project.cruds import (
+    DELETION_JOB_PROJECTION,
+    OWNER_PROJECTION,
+    POST_LIST_PROJECTION,
+    POST_UPDATABLE_FIELDS,
+    POSTS_VERSION_PROJECTION,
+    TOKEN_USER_PROJECTION,
+    USER_LIST_PROJECTION,
+    USER_PROJECTION,
+    USER_UPDATABLE_FIELDS,
+    VERSION_PROJECTION,
+    _new_deletion_job,
+    _new_post,
+    _new_user,
+    _page_cursor,
+    _post_search_spec,
+    _posts_owner_update,
+    _split_page,
+    _split_search,
+    _update_spec,
+    _updated_document,
+    _user_posts_query,
+    _user_search_specs,
+    _username_prefix,
+    posts_added_update,
+    posts_changed_update,
+    posts_removed_update,
+)
+from project.database import client_options, get_collection
+from project.indexes import unique_indexes_verified, verify_unique_indexes
+
+client = None
+db = None
+
+
+def init_db(app):
+    """Create the Motor client. Must run inside the serving event loop."""
+    global client, db
+    if client is None:
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        client = AsyncIOMotorClient(
+            app.config["MONGO_URI"], **client_options(app.config)
+        )
+        db = client.get_default_database()
+    return db
+
+
+def users(query_class="lookup"):
+    return get_collection(db, "users", query_class)
+
+
+def posts(query_class="lookup"):
+    return get_collection(db, "posts", query_class)
+
+
+def deletion_jobs(query_class="lookup"):
+    return get_collection(db, "deletion_jobs", query_class)
+
+
+def close_db():
+    global client, db
+    if client is not None:
+        client.close()
+    client = db = None
+
+
+async def signup(email, username, usertype, hashed_password):
+    if not unique_indexes_verified():
+        verify_unique_indexes(await users().index_information())
+    return await users().insert_one(
+        _new_user(email, username, usertype, hashed_password)
+    )
+
+
+async def get_user_by_email(email):
+    return await users().find_one({"email": email, "deleting": {"$ne": True}})
+
+
+async def get_token_user(user_id):
+    return await users().find_one({"user_id": user_id}, TOKEN_USER_PROJECTION)
+
+
+async def get_user_by_user_id(user_id):
+    return await users().find_one({"user_id": user_id}, USER_PROJECTION)
+
+
+async def get_user_version(user_id):
+    return await users().find_one({"user_id": user_id}, VERSION_PROJECTION)
+
+
+async def get_user_posts_version(user_id):
+    return await users().find_one({"user_id": user_id}, POSTS_VERSION_PROJECTION)
+
+
+async def find_users_by_username_or_email(username, email):
+    query = {"$or": [{"username": username}, {"email": email}]}
+    return await users().find(query, OWNER_PROJECTION).to_list(2)
+
+
+async def get_users_page(username=None, limit=20, cursor=None):
+    return await _paginate(
+        users("listing"),
+        "user_id",
+        _username_prefix(username),
+        USER_LIST_PROJECTION,
+        limit,
+        cursor,
+    )
+
+
+async def search_users(text, limit=20, offset=0):
+    wanted = offset + limit + 1
+    docs = []
+    for query, projection, sort in _user_search_specs(text):
+        cursor = users("listing").find(query, projection).sort(sort)
+        docs += await cursor.to_list(wanted - len(docs))
+        if len(docs) >= wanted:
+            break
+    return _split_search(docs[offset:], limit, offset)
+
+
+async def update_user(user_id, data_dict, email=None, version=None):
+    query, update = _update_spec(
+        {"user_id": user_id, "deleting": {"$ne": True}},
+        USER_UPDATABLE_FIELDS,
+        data_dict,
+        email,
+        version,
+    )
+    before = await users().find_one_and_update(
+        query, update, return_document=ReturnDocument.BEFORE
+    )
+    await offload(cache.delete, f"user:{user_id}")
+    if before is None:
+        return None
+    user = _updated_document(before, update)
+    owner_update = _posts_owner_update(before, user)
+    if owner_update:
+        owned = {"username": before["username"]}
+        post_ids = await posts().distinct("post_id", owned)
+        await posts().update_many(owned, owner_update)
+        await offload(cache.delete, *[f"post:{post_id}" for post_id in post_ids])
+    return user
+
+
+async def update_user_password(user_id, hashed_password):
+    result = await users().update_one(
+        {"user_id": user_id}, {"$set": {"password": hashed_password}}
+    )
+    await offload(cache.delete, f"user:{user_id}")
+    return result
+
+
+async def enqueue_user_deletion(user, requested_by):
+    await users().update_one({"user_id": user["user_id"]}, {"$set": {"deleting": True}})
+    await offload(cache.delete, f"user:{user['user_id']}")
+    job = await deletion_jobs().find_one_and_update(
+        {"user_id": user["user_id"]},
+        {"$setOnInsert": _new_deletion_job(user, requested_by)},
+        projection=DELETION_JOB_PROJECTION,
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    if job["status"] == "failed":
+        retry = {"status": "pending", "attempts": 0, "error": None}
+        await deletion_jobs().update_one(
+            {"user_id": user["user_id"], "status": "failed"},
+            {"$set": {**retry, "lease_until": datetime.now()}},
+        )
+        job.update(retry)
+    return job
+
+
+async def get_deletion_job(user_id):
+    return await deletion_jobs().find_one({"user_id": user_id}, DELETION_JOB_PROJECTION)
+
+
+async def create_post(email, username, title):
+    post = _new_post(email, username, title)
+    result = await posts().insert_one(post)
+    await _count_posts(username, posts_added_update(1, post["created_on"]))
+    return result
+
+
+async def get_post_by_post_id(post_id):
+    return await posts().find_one({"post_id": post_id})
+
+
+async def get_post_version(post_id):
+    return await posts().find_one({"post_id": post_id}, VERSION_PROJECTION)
+
+
+async def get_posts_page(username=None, limit=20, cursor=None):
+    return await _paginate(
+        posts("listing"),
+        "post_id",
+        _username_prefix(username),
+        POST_LIST_PROJECTION,
+        limit,
+        cursor,
+    )
+
+
+async def search_posts(text, limit=20, offset=0):
+    return await _search(posts("listing"), _post_search_spec(text), limit, offset)
+
+
+async def get_user_posts_page(username, limit=20, cursor=None, since=None, fields=None):
+    query, projection = _user_posts_query(username, since, fields)
+    return await _paginate(
+        posts("listing"), "post_id", query, projection, limit, cursor
+    )
+
+
+async def update_post(post_id, data_dict, email=None, version=None):
+    post = await _update(
+        posts(),
+        f"post:{post_id}",
+        {"post_id": post_id},
+        POST_UPDATABLE_FIELDS,
+        data_dict,
+        email,
+        version,
+    )
+    if post:
+        await _count_posts(post["username"], posts_changed_update(post["updated_on"]))
+    return post
+
+
+async def delete_post_by_id(post_id):
+    post = await posts().find_one_and_delete(
+        {"post_id": post_id}, projection={"_id": 0, "username": 1}
+    )
+    await offload(cache.delete, f"post:{post_id}")
+    if not post:
+        return "failed"
+    latest = await posts().find_one(
+        {"username": post["username"]},
+        {"_id": 0, "created_on": 1},
+        sort=[("created_on", -1)],
+    )
+    await _count_posts(post["username"], posts_removed_update(1, latest))
+    return "success"
+
+
+async def _count_posts(username, update):
+    user = await users().find_one_and_update(
+        {"username": username}, update, projection={"_id": 0, "user_id": 1}
+    )
+    if user:
+        await offload(cache.delete, f"user:{user['user_id']}")
+
+
+async def _paginate(collection, key, query, projection, limit, cursor):
+    docs = await _page_cursor(
+        collection, key, query, projection, limit, cursor
+    ).to_list(limit + 1)
+    return _split_page(docs, key, limit)
+
+
+async def _search(collection, spec, limit, offset):
+    query, projection, sort = spec
+    cursor = collection.find(query, projection).sort(sort).skip(offset)
+    cursor = cursor.limit(limit + 1)
+    return _split_search(await cursor.to_list(limit + 1), limit, offset)
+
+
+async def _update(collection, cache_key, query, allowed, data_dict, email, version):
+    query, update = _update_spec(query, allowed, data_dict, email, version)
+    document = await collection.find_one_and_update(
+        query, update, return_document=ReturnDocument.AFTER
+    )
+    await offload(cache.delete, cache_key)
+    return document
@@ -0,0 +1,448 @@
+"""
+Async handlers of the auth, users and posts endpoints for the ASGI mode.
+They answer with the same status codes and bodies as the flask-restx
+resources in project/apis.
+"""
+
+from datetime import datetime
+
+from flask import current_app as app
+from pymongo.errors import DuplicateKeyError
+
+from project import deletions, hashing, limiter
+from project.aio import cruds
+from project.aio.app import HTTPError, token_required
+from project.aio.blocking import offload
+from project.cruds import (
+    POST_FIELDS,
+    POST_UPDATABLE_FIELDS,
+    USER_UPDATABLE_FIELDS,
+    duplicate_key_field,
+    user_posts_version,
+    user_summary,
+)
+from project.hashing import HashingBusy
+from project.indexes import IndexesMissing
+from project.utils import (
+    cache_headers,
+    claim_token,
+    decode_auth_token,
+    encode_auth_token,
+    encode_cursor,
+    encode_refresh_token,
+    is_not_modified,
+    last_modified,
+    make_etag,
+    make_listing_etag,
+    parse_search_args,
+    revoke_token,
+    search_page,
+)
+
+
+def _if_match_version(request):
+    if_match = request.headers.get("if-match", "").strip()
+    if not if_match or if_match == "*":
+        return None
+    try:
+        return int(if_match.removeprefix("W/").strip('"'))
+    except ValueError:
+        raise HTTPError(412, "Malformed If-Match header")
+
+
+def _not_modified(request, etag, modified):
+    return is_not_modified(
+        etag,
+        modified,
+        request.headers.get("if-none-match"),
+        request.headers.get("if-modified-since"),
+    )
+
+
+def _is_conditional(request):
+    return "if-none-match" in request.headers or "if-modified-since" in request.headers
+
+
+def _search_args(request):
+    try:
+        return parse_search_args(request.args, request.config)
+    except ValueError as e:
+        raise HTTPError(400, str(e))
+
+
+def _page(docs, next_cursor):
+    return {
+        "data": docs,
+        "next": encode_cursor(*next_cursor) if next_cursor else None,
+        "msg": "success",
+    }
+
+
+def _user_data(user):
+    return {
+        "user_id": user["user_id"],
+        "created_on": user["created_on"],
+        "username": user["username"],
+        "email": user["email"],
+    }
+
+
+def _post_data(post):
+    return {
+        "post_id": post["post_id"],
+        "created_on": post["created_on"],
+        "username": post["username"],
+        "email": post["email"],
+        "title": post["title"],
+    }
+
+
+# Auth
+
+
+async def signup(request):
+    data = request.json()
+    email = data.get("email")
+    username = data.get("username")
+    password = data.get("password")
+    usertype = data.get("usertype")
+    await offload(limiter.check, ip=request.client, email=email)
+    if not (username and email and password and usertype):
+        raise HTTPError(400, "Please fill up all the required fields")
+    hashed_password = await hashing.generate_password_hash_async(password)
+    try:
+        await cruds.signup(email, username, usertype, hashed_password)
+    except DuplicateKeyError as e:
+        field = "username" if duplicate_key_field(e) == "username" else "email"
+        raise HTTPError(409, f"User with this {field} already exists. Please login.")
+    except IndexesMissing as e:
+        app.logger.error("Signup refused: %s", e)
+        raise HTTPError(503, "Signup is unavailable, please retry later.")
+    return {"message": "User signed up successfully"}, 200
+
+
+async def login(request):
+    data = request.json()
+    email = data.get("email")
+    password = data.get("password")
+    await offload(limiter.check, ip=request.client, email=email)
+    if not (email and password):
+        raise HTTPError(400, "Please fill up all the fields.")
+    user = await cruds.get_user_by_email(email)
+    if not user:
+        raise HTTPError(404, "User doesn't exist.")
+    if not await hashing.check_password_hash_async(user["password"], password):
+        raise HTTPError(401, "Wrong password.")
+    await offload(limiter.reset, email)
+    if hashing.needs_rehash(user["password"]):
+        try:
+            await cruds.update_user_password(
+                user["user_id"], await hashing.generate_password_hash_async(password)
+            )
+        except HashingBusy:
+            app.logger.info("Rehash of user %s postponed", user["user_id"])
+    auth_token = encode_auth_token(
+        email, user["usertype"], user["username"], str(user["_id"]), user["user_id"]
+    )
+    return {
+        "auth_token": auth_token,
+        "refresh_token": encode_refresh_token(user["user_id"]),
+        "message": "Logged in successfully!",
+    }, 200
+
+
+async def refresh(request):
+    refresh_token = request.json().get("refresh_token")
+    if not refresh_token:
+        raise HTTPError(400, "refresh_token is required")
+    payload = await offload(decode_auth_token, refresh_token, "refresh")
+    if isinstance(payload, str):
+        raise HTTPError(401, f"{payload.capitalize()} refresh token.")
+    if not await offload(claim_token, payload):
+        raise HTTPError(401, "Revoked refresh token.")
+    user = await cruds.get_token_user(payload["user_id"])
+    if not user or user.get("deleting"):
+        raise HTTPError(401, "Invalid refresh token.")
+    auth_token = encode_auth_token(
+        user["email"],
+        user["usertype"],
+        user["username"],
+        str(user["_id"]),
+        user["user_id"],
+    )
+    return {
+        "auth_token": auth_token,
+        "refresh_token": encode_refresh_token(user["user_id"]),
+        "message": "Token refreshed successfully!",
+    }, 200
+
+
+@token_required
+async def authenticate(request):
+    return {"message": f"This {request.principal.usertype} token is valid."}, 200
+
+
+@token_required
+async def logout(request):
+    await offload(revoke_token, request.principal.claims)
+    if request.method == "POST":
+        refresh_token = request.json().get("refresh_token")
+        if refresh_token:
+            payload = await offload(decode_auth_token, refresh_token, "refresh")
+            if isinstance(payload, dict):
+                await offload(revoke_token, payload)
+    return {"status": "success", "message": "Successfully logged out!"}, 200
+
+
+# Users
+
+
+@token_required
+async def list_users(request):
+    limit, cursor = request.page_args()
+    docs, next_cursor = await cruds.get_users_page(
+        request.args.get("username"), limit, cursor
+    )
+    return _page(docs, next_cursor), 200
+
+
+@token_required
+async def search_users(request):
+    docs, next_offset = await cruds.search_users(*_search_args(request))
+    return search_page(docs, next_offset), 200
+
+
+@token_required
+async def get_user(request):
+    user_id = request.params["user_id"]
+    if _is_conditional(request):
+        meta = await cruds.get_user_version(user_id)
+        if meta and _not_modified(request, make_etag(meta), last_modified(meta)):
+            return "", 304, cache_headers(make_etag(meta), last_modified(meta))
+    user = await cruds.get_user_by_user_id(user_id)
+    if not user:
+        raise HTTPError(404, f"User with ID {user_id} not found")
+    return _user_data(user), 200, cache_headers(make_etag(user), last_modified(user))
+
+
+@token_required
+async def update_user(request):
+    user_id = request.params["user_id"]
+    email = request.principal.email
+    payload = request.json()
+    if not any(key in USER_UPDATABLE_FIELDS for key in payload):
+        raise HTTPError(
+            400, f"Nothing to update, allowed fields: {USER_UPDATABLE_FIELDS}"
+        )
+    version = _if_match_version(request)
+    try:
+        user = await cruds.update_user(user_id, payload, email=email, version=version)
+    except DuplicateKeyError:
+        raise HTTPError(409, "User with this username or email already exists")
+    if not user:
+        user = await cruds.get_user_by_user_id(user_id)
+        if not user:
+            raise HTTPError(404, f"User with ID {user_id} not found")
+        if user["email"] != email:
+            return "Not Authorized", 401
+        if user.get("deleting"):
+            raise HTTPError(409, "User is being deleted")
+        raise HTTPError(412, "User was modified by another request")
+    return _user_data(user), 200, {"ETag": make_etag(user)}
+
+
+@token_required
+async def delete_user(request):
+    user_id = request.params["user_id"]
+    if not request.principal.is_admin:
+        raise HTTPError(400, "Not Authorized")
+    user = await cruds.get_user_by_user_id(user_id)
+    if not user:
+        raise HTTPError(404, f"User with ID {user_id} not found")
+    job = await cruds.enqueue_user_deletion(user, request.principal.email)
+    # the worker thread runs the job with the sync client
+    deletions.notify()
+    return (
+        {**job, "msg": "deletion queued"},
+        202,
+        {"Location": f"/users/{user_id}/deletion-status"},
+    )
+
+
+@token_required
+async def get_deletion_status(request):
+    user_id = request.params["user_id"]
+    if not request.principal.is_admin:
+        return "Not Authorized", 401
+    job = await cruds.get_deletion_job(user_id)
+    if not job:
+        raise HTTPError(404, f"No deletion requested for user {user_id}")
+    return job, 200
+
+
+@token_required
+async def get_user_summary(request):
+    user_id = request.params["user_id"]
+    user = await cruds.get_user_by_user_id(user_id)
+    if not user:
+        raise HTTPError(404, f"User with ID {user_id} not found")
+    return user_summary(user), 200
+
+
+@token_required
+async def list_user_posts(request):
+    user_id = request.params["user_id"]
+    limit, cursor = request.page_args()
+    fields = [f for f in request.args.get("fields", "").split(",") if f]
+    if set(fields) - set(POST_FIELDS):
+        raise HTTPError(400, "Unknown fields")
+    try:
+        since = request.args.get("since")
+        since = datetime.fromisoformat(since) if since else None
+    except ValueError:
+        raise HTTPError(400, "'since' must be an ISO 8601 datetime")
+    user = await cruds.get_user_posts_version(user_id)
+    if not user:
+        raise HTTPError(404, f"User with ID {user_id} not found")
+    meta = user_posts_version(user)
+    headers = cache_headers(make_listing_etag(meta), meta["updated_on"])
+    if _is_conditional(request) and _not_modified(
+        request, headers["ETag"], meta["updated_on"]
+    ):
+        return "", 304, headers
+    docs, next_cursor = await cruds.get_user_posts_page(
+        user["username"], limit, cursor, since, fields
+    )
+    page = _page(docs, next_cursor)
+    if fields:
+        page["data"] = [{f: doc[f] for f in fields if f in doc} for doc in docs]
+    return page, 200, headers
+
+
+@token_required
+async def create_user_post(request):
+    user_id = request.params["user_id"]
+    user_email = request.principal.email
+    payload = request.json()
+    user = await cruds.get_user_by_user_id(user_id)
+    if not user:
+        return "No user found", 404
+    if user.get("deleting"):
+        return "User is being deleted", 409
+    matches = await cruds.find_users_by_username_or_email(user["username"], user_email)
+    if not any(u["email"] == user_email for u in matches):
+        raise HTTPError(404, "No user found with this username")
+    if not payload.get("title"):
+        raise HTTPError(400, "Something went wrong")
+    await cruds.create_post(user_email, user["username"], payload["title"])
+    return {"msg": "post created successfully"}, 201
+
+
+# Posts
+
+
+async def list_posts(request):
+    limit, cursor = request.page_args()
+    docs, next_cursor = await cruds.get_posts_page(
+        request.args.get("username"), limit, cursor
+    )
+    return _page(docs, next_cursor), 200
+
+
+async def search_posts(request):
+    docs, next_offset = await cruds.search_posts(*_search_args(request))
+    return search_page(docs, next_offset), 200
+
+
+@token_required
+async def create_post(request):
+    payload = request.json()
+    user_email = request.principal.email
+    username = payload.get("username")
+    if not username or not payload.get("title"):
+        raise HTTPError(400, "Something went wrong")
+    matches = await cruds.find_users_by_username_or_email(username, user_email)
+    user = next((u for u in matches if u["username"] == username), None)
+    if not user or not any(u["email"] == user_email for u in matches):
+        return "No user found with this username", 404
+    if user["email"] != user_email:
+        return "Not Authorized", 401
+    if user.get("deleting"):
+        return "User is being deleted", 409
+    await cruds.create_post(user_email, username, payload["title"])
+    return {"msg": "post created successfully"}, 201
+
+
+@token_required
+async def get_post(request):
+    post_id = request.params["post_id"]
+    if _is_conditional(request):
+        meta = await cruds.get_post_version(post_id)
+        if meta and _not_modified(request, make_etag(meta), last_modified(meta)):
+            return "", 304, cache_headers(make_etag(meta), last_modified(meta))
+    post = await cruds.get_post_by_post_id(post_id)
+    if not post:
+        raise HTTPError(404, f"Post with ID {post_id} not found")
+    data = _post_data(post)
+    del data["title"]
+    return data, 200, cache_headers(make_etag(post), last_modified(post))
+
+
+@token_required
+async def update_post(request):
+    post_id = request.params["post_id"]
+    payload = request.json()
+    if not any(key in POST_UPDATABLE_FIELDS for key in payload):
+        raise HTTPError(
+            400, f"Nothing to update, allowed fields: {POST_UPDATABLE_FIELDS}"
+        )
+    version = _if_match_version(request)
+    principal = request.principal
+    owner = None if principal.usertype == "admin" else principal.email
+    post = await cruds.update_post(post_id, payload, email=owner, version=version)
+    if not post:
+        post = await cruds.get_post_by_post_id(post_id)
+        if not post:
+            raise HTTPError(404, f"Post with ID {post_id} not found")
+        if owner and post["email"] != owner:
+            return "Not Authorized", 401
+        raise HTTPError(412, "Post was modified by another request")
+    return _post_data(post), 200, {"ETag": make_etag(post)}
+
+
+@token_required
+async def delete_post(request):
+    post_id = request.params["post_id"]
+    post = await cruds.get_post_by_post_id(post_id)
+    if not post:
+        raise HTTPError(404, f"Post with ID {post_id} not found")
+    principal = request.principal
+    if principal.usertype != "admin" and post["email"] != principal.email:
+        return "Not Authorized", 401
+    await cruds.delete_post_by_id(post_id)
+    return "", 204
+
+
+routes = [
+    ("POST", "/auth/signup", signup),
+    ("POST", "/auth/login", login),
+    ("POST", "/auth/refresh", refresh),
+    ("GET", "/auth/logout", logout),
+    ("POST", "/auth/logout", logout),
+    ("GET", "/auth/authenticate", authenticate),
+    ("GET", "/users/", list_users),
+    ("GET", "/users/search", search_users),
+    ("GET", "/users/{user_id}", get_user),
+    ("PUT", "/users/{user_id}", update_user),
+    ("DELETE", "/users/{user_id}", delete_user),
+    ("GET", "/users/{user_id}/posts", list_user_posts),
+    ("POST", "/users/{user_id}/posts", create_user_post),
+    ("GET", "/users/{user_id}/summary", get_user_summary),
+    ("GET", "/users/{user_id}/deletion-status", get_deletion_status),
+    ("GET", "/posts/", list_posts),
+    ("GET", "/posts/search", search_posts),
+    ("POST", "/posts/", create_post),
+    ("GET", "/posts/{post_id}", get_post),
+    ("PUT", "/posts/{post_id}", update_post),
+    ("DELETE", "/posts/{post_id}", delete_post),
+]
@@ -1,11 +1,21 @@
+from flask import Response
 from flask_restx import Api
 
 from project.apis.auth import auth_namespace
+from project.apis.health import health_namespace
 from project.apis.posts import post_namespace
 from project.apis.users import user_namespace
+from project.serialization import dumps
 
 api = Api(version="2.0", title="Simple Rest Web Service")
 
+
+@api.representation("application/json")
+def output_json(data, code, headers=None):
+    return Response(dumps(data), code, headers, mimetype="application/json")
+
+
 api.add_namespace(auth_namespace, "/auth")
 api.add_namespace(user_namespace, "/users")
 api.add_namespace(post_namespace, "/posts")
+api.add_namespace(health_namespace, "/health")
@@ -1,18 +1,28 @@
-import logging
-
+from flask import Response
 from flask import current_app as app
 from flask import request
 from flask_restx import Namespace, Resource, fields
+from pymongo.errors import DuplicateKeyError
 
-from project import bcrypt
+from project import hashing, keyring, limiter
 from project.cruds import (
+    duplicate_key_field,
+    get_token_user,
     get_user_by_email,
-    get_user_count_by_email,
-    get_user_count_by_username,
     signup,
+    update_user_password,
+)
+from project.decorator import current_principal, token_required
+from project.hashing import HashingBusy
+from project.indexes import IndexesMissing
+from project.ratelimit import RateLimited
+from project.utils import (
+    claim_token,
+    decode_auth_token,
+    encode_auth_token,
+    encode_refresh_token,
+    revoke_token,
 )
-from project.decorator import token_required
-from project.utils import encode_auth_token
 
 auth_namespace = Namespace("auth")
 
@@ -35,10 +45,15 @@ login_model_response = auth_namespace.model(
     "login_model_response",
     {
         "auth_token": fields.String(required=True),
+        "refresh_token": fields.String(required=True),
         "message": fields.String(required=True),
     },
 )
 
+refresh_model = auth_namespace.model(
+    "refresh_model", {"refresh_token": fields.String(required=True)}
+)
+
 logout_response_model = auth_namespace.model(
     "logout_response_model",
     {
@@ -48,6 +63,35 @@ logout_response_model = auth_namespace.model(
 )
 
 
+@auth_namespace.errorhandler(HashingBusy)
+def handle_hashing_busy(error):
+    return (
+        {"message": "Server is busy, please retry later."},
+        503,
+        {"Retry-After": str(error.retry_after)},
+    )
+
+
+@auth_namespace.errorhandler(RateLimited)
+def handle_rate_limited(error):
+    return (
+        {"message": "Too many attempts, please retry later."},
+        429,
+        {"Retry-After": str(error.retry_after)},
+    )
+
+
+def rehash_password(user, password):
+    """Upgrade a stored hash whose cost differs from BCRYPT_LOG_ROUNDS."""
+    if not hashing.needs_rehash(user["password"]):
+        return
+    try:
+        update_user_password(user["user_id"], hashing.generate_password_hash(password))
+    except HashingBusy:
+        # Not worth failing the login for; it is retried on the next one.
+        app.logger.info("Rehash of user %s postponed", user["user_id"])
+
+
 class Signup(Resource):
     @auth_namespace.expect(signup_model, validate=True)
     @auth_namespace.response(200, "User signed up successfully.")
@@ -56,30 +100,31 @@ class Signup(Resource):
     )
     @auth_namespace.response(409, "User with this email already exists. Please login.")
     @auth_namespace.response(400, "Please fill up all the fields.")
+    @auth_namespace.response(429, "Too many attempts, please retry later.")
+    @auth_namespace.response(503, "Server is busy, please retry later.")
     def post(self):
         data = request.get_json()
-        app.logger.info(f"payload: {data}")
         email = data.get("email")
         username = data.get("username")
         password = data.get("password")
         usertype = data.get("usertype")
+        limiter.check(ip=request.remote_addr, email=email)
         if username and email and password and usertype:
-            if get_user_count_by_email(email) <= 0:
-                if get_user_count_by_username(username) <= 0:
-                    hashed_password = bcrypt.generate_password_hash(
-                        password, 13
-                    ).decode()
-                    app.logger.info(hashed_password)
-                    signup(email, username, usertype, hashed_password)
-                    return {"message": "User signed up successfully"}, 200
-                else:
+            hashed_password = hashing.generate_password_hash(password)
+            try:
+                signup(email, username, usertype, hashed_password)
+            except DuplicateKeyError as e:
+                if duplicate_key_field(e) == "username":
                     auth_namespace.abort(
                         409, f"User with this username already exists. Please login."
                     )
-            else:
                 auth_namespace.abort(
                     409, f"User with this email already exists. Please login."
                 )
+            except IndexesMissing as e:
+                app.logger.error("Signup refused: %s", e)
+                auth_namespace.abort(503, "Signup is unavailable, please retry later.")
+            return {"message": "User signed up successfully"}, 200
         else:
             auth_namespace.abort(400, f"Please fill up all the required fields")
 
@@ -88,8 +133,8 @@ class TokenValidation(Resource):
     @token_required
     @auth_namespace.response(200, "The Token is valid.")
     def get(self):
-        type = TokenValidation.get.usertype
-        app.logger.info(type)
+        type = current_principal().usertype
+        app.logger.info("Valid %s token", type)
         return {"message": f"This {type} token is valid."}, 200
 
 
@@ -99,23 +144,29 @@ class Login(Resource):
     @auth_namespace.response(401, "Wrong password.")
     @auth_namespace.response(404, "User doesn't exist.")
     @auth_namespace.response(400, "Please fill up all the fields.")
+    @auth_namespace.response(429, "Too many attempts, please retry later.")
+    @auth_namespace.response(503, "Server is busy, please retry later.")
     def post(self):
         data = request.get_json()
-        app.logger.info(f"**** PAYLOAD LOGIN {data} *****")
         email = data.get("email")
         password = data.get("password")
+        limiter.check(ip=request.remote_addr, email=email)
         if email and password:
             user = get_user_by_email(email)
             if user:
-                isValid = bcrypt.check_password_hash(user["password"], password)
+                isValid = hashing.check_password_hash(user["password"], password)
                 if isValid:
+                    limiter.reset(email)
+                    rehash_password(user, password)
                     name = user["username"]
                     _id = str(user["_id"])
 
-                    auth_token = encode_auth_token(email, user["usertype"], name, _id)
-                    app.logger.info(auth_token)
+                    auth_token = encode_auth_token(
+                        email, user["usertype"], name, _id, user["user_id"]
+                    )
                     responseObject = {
                         "auth_token": auth_token,
+                        "refresh_token": encode_refresh_token(user["user_id"]),
                         "message": "Logged in successfully!",
                     }
                     return responseObject, 200
@@ -127,15 +178,81 @@ class Login(Resource):
             auth_namespace.abort(400, "Please fill up all the fields.")
 
 
+class Refresh(Resource):
+    @auth_namespace.marshal_with(login_model_response)
+    @auth_namespace.expect(refresh_model, validate=True)
+    @auth_namespace.response(401, "Invalid, expired or revoked refresh token.")
+    def post(self):
+        """
+        Exchange a refresh token for a new access token and a new refresh
+        token. The presented refresh token is revoked, so each one works once.
+        """
+        payload = decode_auth_token(request.get_json()["refresh_token"], "refresh")
+        if isinstance(payload, str):
+            auth_namespace.abort(401, f"{payload.capitalize()} refresh token.")
+        if not claim_token(payload):
+            auth_namespace.abort(401, "Revoked refresh token.")
+        user = get_token_user(payload["user_id"])
+        if not user or user.get("deleting"):
+            auth_namespace.abort(401, "Invalid refresh token.")
+        auth_token = encode_auth_token(
+            user["email"],
+            user["usertype"],
+            user["username"],
+            str(user["_id"]),
+            user["user_id"],
+        )
+        return {
+            "auth_token": auth_token,
+            "refresh_token": encode_refresh_token(user["user_id"]),
+            "message": "Token refreshed successfully!",
+        }, 200
+
+
+class Jwks(Resource):
+    @auth_namespace.response(200, "Public keys that verify the tokens (RFC 7517).")
+    @auth_namespace.response(304, "Not modified")
+    def get(self):
+        """
+        Lets gateways and other services verify tokens without SECRET_KEY.
+        Served from bytes built once at startup.
+        """
+        etag = keyring.jwks_etag
+        headers = {
+            "Cache-Control": f"public, max-age={app.config['JWKS_MAX_AGE']}",
+            "ETag": f'"{etag}"',
+        }
+        if etag in request.if_none_match:
+            return Response(status=304, headers=headers)
+        return Response(keyring.jwks, mimetype="application/json", headers=headers)
+
+
 class Logout(Resource):
     @token_required
     @auth_namespace.response(200, "Logout successfully")
     def get(self):
+        revoke_token(current_principal().claims)
+        response_object = {"status": "success", "message": "Successfully logged out!"}
+        return response_object, 200
+
+    @token_required
+    @auth_namespace.expect(refresh_model)
+    @auth_namespace.response(200, "Logout successfully")
+    def post(self):
+        """Revoke the access token and, when given, the refresh token."""
+        revoke_token(current_principal().claims)
+        refresh_token = (request.get_json(silent=True) or {}).get("refresh_token")
+        if refresh_token:
+            payload = decode_auth_token(refresh_token, "refresh")
+            if isinstance(payload, dict):
+                revoke_token(payload)
         response_object = {"status": "success", "message": "Successfully logged out!"}
         return response_object, 200
 
 
 auth_namespace.add_resource(Signup, "/signup", endpoint="signup")
 auth_namespace.add_resource(Login, "/login", endpoint="login")
+auth_namespace.add_resource(Refresh, "/refresh", endpoint="refresh")
 auth_namespace.add_resource(Logout, "/logout", endpoint="logout")
+auth_namespace.add_resource(Jwks, "/.well-known/jwks.json", endpoint="jwks")
 auth_namespace.add_resource(TokenValidation, "/authenticate", endpoint="authenticate")
@@ -0,0 +1,31 @@
+from flask import current_app as app
+from flask_restx import Namespace, Resource
+from pymongo.errors import PyMongoError
+
+from project.database import ping, pool_monitor
+
+health_namespace = Namespace("health")
+
+
+class Health(Resource):
+    @health_namespace.response(200, "Service and database are up")
+    @health_namespace.response(503, "Database unreachable")
+    def get(self):
+        """Database latency and connection pool usage of this worker"""
+        try:
+            latency_ms = ping()
+        except PyMongoError as e:
+            app.logger.error("Health check failed: %s", e)
+            return {
+                "status": "unavailable",
+                "db": {"error": str(e)},
+                "pool": pool_monitor.stats(),
+            }, 503
+        return {
+            "status": "ok",
+            "db": {"latency_ms": latency_ms},
+            "pool": pool_monitor.stats(),
+        }, 200
+
+
+health_namespace.add_resource(Health, "")
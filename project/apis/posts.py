@@ -4,16 +4,37 @@ from flask import request
 from flask_restx import Namespace, Resource, fields
 
 from project.cruds import (
+    POST_UPDATABLE_FIELDS,
     create_post,
+    create_posts,
     delete_post_by_id,
-    get_all_posts,
+    delete_posts_by_ids,
+    export_posts_cursor,
+    find_users_by_username_or_email,
     get_post_by_post_id,
-    get_user_by_email,
-    get_user_by_user_id,
-    get_user_by_username,
+    get_post_version,
+    get_posts_page,
+    get_users_by_usernames,
+    search_posts,
     update_post,
 )
-from project.decorator import token_required
+from project.decorator import current_principal, token_required
+from project.streaming import stream_ndjson
+from project.utils import (
+    cache_headers,
+    check_batch_items,
+    encode_cursor,
+    get_batch,
+    get_if_match_version,
+    get_page_args,
+    get_search_args,
+    get_since_arg,
+    is_conditional,
+    last_modified,
+    make_etag,
+    not_modified,
+    search_page,
+)
 
 post_namespace = Namespace("posts")
 
@@ -26,32 +47,36 @@ create_post_model = post_namespace.model(
     },
 )
 
+bulk_create_post_model = post_namespace.model(
+    "BulkPosts",
+    {"posts": fields.List(fields.Nested(create_post_model), required=True)},
+)
+
+bulk_delete_post_model = post_namespace.model(
+    "BulkPostIds",
+    {"post_ids": fields.List(fields.String, required=True)},
+)
+
 
 class Posts(Resource):
     @post_namespace.response(200, "Get posts data")
     @post_namespace.response(400, "Error in getting data")
     def get(self):
         """Get all posts"""
-        """Get all posts with optional query parameters 'username' and 'limit'"""
+        """Get a page of posts with optional query parameters 'username', 'limit' and 'next'"""
+        name = request.args.get("username")
         try:
-            name = request.args.get("username")
-            limit = request.args.get("limit", type=int)
-
-            posts = get_all_posts()
-            app.logger.info(f"posts: {posts}")
-
-            filtered_posts = posts
-            if name:
-                filtered_posts = [post for post in posts if name in post["username"]]
-
-            if limit:
-                filtered_posts = filtered_posts[:limit]
-
-            for post in filtered_posts:
-                post["created_on"] = str(post["created_on"])
-                del post["_id"]
-
-            resp_data = {"data": filtered_posts, "msg": "success"}
+            limit, cursor = get_page_args()
+        except ValueError:
+            abort(400, "Invalid cursor")
+        try:
+            posts, next_cursor = get_posts_page(name, limit, cursor)
+            app.logger.info("posts: %s", len(posts))
+            resp_data = {
+                "data": posts,
+                "next": encode_cursor(*next_cursor) if next_cursor else None,
+                "msg": "success",
+            }
             return resp_data, 200
         except Exception as e:
             return {"Error": e}, 400
@@ -59,19 +84,23 @@ class Posts(Resource):
     @token_required
     @post_namespace.expect(create_post_model)
     @post_namespace.response(201, "Post created successfully")
+    @post_namespace.response(409, "User is being deleted")
     def post(self):
         """Create a new post"""
         try:
             payload = request.get_json()
-            user_email = getattr(self.post, "email", None)
+            user_email = current_principal().email
             payload["email"] = user_email
             username = payload["username"]
-            app.logger.info(f"payload: {payload}")
-            user = get_user_by_username(username)
+            app.logger.info("payload: %s", payload)
+            matches = find_users_by_username_or_email(username, user_email)
+            user = next((u for u in matches if u["username"] == username), None)
 
-            if get_user_by_username(username) and get_user_by_email(user_email):
+            if user and any(u["email"] == user_email for u in matches):
                 if user["email"] != user_email:
                     return "Not Authorized", 401
+                if user.get("deleting"):
+                    return "User is being deleted", 409
 
                 post = create_post(user_email, username, payload["title"])
 
@@ -83,74 +112,94 @@ class Posts(Resource):
             abort(400, "Something went wrong")
 
 
+class PostSearch(Resource):
+    @post_namespace.response(200, "Matching posts, best match first")
+    @post_namespace.response(400, "Invalid query parameters")
+    def get(self):
+        """Full-text search on post titles with query parameters 'q', 'limit' and 'next'"""
+        try:
+            text, limit, offset = get_search_args()
+        except ValueError as e:
+            abort(400, str(e))
+        posts, next_offset = search_posts(text, limit, offset)
+        app.logger.info("post search: %s results", len(posts))
+        return search_page(posts, next_offset), 200
+
+
 # Upper-Level Resource 2: Posts
 class Post(Resource):
     @token_required
+    @post_namespace.response(304, "Post not modified")
     @post_namespace.response(404, "User not found")
     def get(self, post_id):
-        """Get a specific post"""
-        app.logger.info(f"Fetching user {post_id}")
+        """Get a specific post, or 304 when If-None-Match / If-Modified-Since still match"""
+        app.logger.info("Fetching user %s", post_id)
+        if is_conditional():
+            meta = get_post_version(post_id)
+            if meta and not_modified(make_etag(meta), last_modified(meta)):
+                return "", 304, cache_headers(make_etag(meta), last_modified(meta))
         post = get_post_by_post_id(post_id)
         if not post:
-            app.logger.warning(f"404 Not Found")
+            app.logger.warning("404 Not Found")
             abort(404, description=f"Post with ID {post_id} not found")
 
         resp_data = {}
         resp_data["post_id"] = post["post_id"]
-        resp_data["created_on"] = str(post["created_on"])
+        resp_data["created_on"] = post["created_on"]
         resp_data["username"] = post["username"]
         resp_data["email"] = post["email"]
 
-        return resp_data, 200
+        return resp_data, 200, cache_headers(make_etag(post), last_modified(post))
 
     @token_required
     @post_namespace.expect(create_post_model)
-    @post_namespace.response(201, "Post created successfully")
+    @post_namespace.response(200, "Post updated successfully")
+    @post_namespace.response(412, "Post was modified by another request")
     def put(self, post_id):
         """Update post"""
+        email = current_principal().email
+        usertype = current_principal().usertype
+        payload = request.get_json() or {}
+        if not any(key in POST_UPDATABLE_FIELDS for key in payload):
+            abort(400, f"Nothing to update, allowed fields: {POST_UPDATABLE_FIELDS}")
         try:
-            email = getattr(self.put, "email", None)
-            usertype = getattr(self.put, "usertype", None)
-            payload = request.get_json()
-            post = get_post_by_post_id(post_id)
+            version = get_if_match_version()
+        except ValueError:
+            abort(412, "Malformed If-Match header")
+
+        owner = None if usertype == "admin" else email
+        post = update_post(post_id, payload, email=owner, version=version)
 
+        if not post:
+            post = get_post_by_post_id(post_id)
             if not post:
-                app.logger.warning(f"404 Not Found")
+                app.logger.warning("404 Not Found")
                 abort(404, description=f"Post with ID {post_id} not found")
+            if owner and post["email"] != owner:
+                return "Not Authorized", 401
+            abort(412, "Post was modified by another request")
 
-            if usertype != "admin":
-                if post["email"] != email:
-                    return "Not Authorized", 401
-
-            payload["post_id"] = post_id
-
-            if update_post(payload):
-                post = get_post_by_post_id(post_id)
-                resp_data = {}
-                resp_data["post_id"] = post["post_id"]
-                resp_data["created_on"] = str(post["created_on"])
-                resp_data["username"] = post["username"]
-                resp_data["email"] = post["email"]
-                resp_data["title"] = post["title"]
-
-                return resp_data, 200
+        resp_data = {}
+        resp_data["post_id"] = post["post_id"]
+        resp_data["created_on"] = post["created_on"]
+        resp_data["username"] = post["username"]
+        resp_data["email"] = post["email"]
+        resp_data["title"] = post["title"]
 
-            abort("Something went wrong", 400)
-        except Exception as e:
-            abort(400, "Something went wrong")
+        return resp_data, 200, {"ETag": make_etag(post)}
 
     @token_required
     @post_namespace.response(204, "Post deleted successfully")
     def delete(self, post_id):
         """delete post"""
         try:
-            email = getattr(self.delete, "email", None)
-            usertype = getattr(self.delete, "usertype", None)
+            email = current_principal().email
+            usertype = current_principal().usertype
 
             post = get_post_by_post_id(post_id)
 
             if not post:
-                app.logger.warning(f"404 Not Found")
+                app.logger.warning("404 Not Found")
                 abort(404, description=f"Post with ID {post_id} not found")
 
             if usertype != "admin":
@@ -158,12 +207,105 @@ class Post(Resource):
                     return "Not Authorized", 401
 
             result = delete_post_by_id(post_id)
-            app.logger.info(f"Post {post_id} deleted")
+            app.logger.info("Post %s deleted", post_id)
             return "", 204
 
         except Exception as e:
             abort(400, "Something went wrong")
 
 
+class PostsExport(Resource):
+    @token_required
+    @post_namespace.response(200, "NDJSON stream of posts")
+    @post_namespace.response(401, "Not Authorized")
+    def get(self):
+        """Export all posts as NDJSON (admin only), optionally only those created after 'since'"""
+        if not current_principal().is_admin:
+            return "Not Authorized", 401
+        try:
+            since = get_since_arg()
+        except ValueError as e:
+            abort(400, str(e))
+        app.logger.info("Exporting posts since %s", since)
+        batch_size = app.config["EXPORT_BATCH_SIZE"]
+        return stream_ndjson(export_posts_cursor(since, batch_size), batch_size)
+
+
+class PostsBulk(Resource):
+    @token_required
+    @post_namespace.expect(bulk_create_post_model)
+    @post_namespace.response(200, "Per-item results")
+    @post_namespace.response(400, "Invalid batch")
+    def post(self):
+        """Create several posts, each for a username owned by the caller"""
+        try:
+            items = get_batch("posts")
+            check_batch_items(items, ("username", "title"))
+        except ValueError as e:
+            abort(400, str(e))
+        email = current_principal().email
+
+        usernames = list({item.get("username") for item in items})
+        owners = {user["username"]: user for user in get_users_by_usernames(usernames)}
+
+        results = [None] * len(items)
+        to_create = []
+        for index, item in enumerate(items):
+            username, title = item.get("username"), item.get("title")
+            if not username or not title:
+                results[index] = {
+                    "status": 400,
+                    "msg": "username and title are required",
+                }
+            elif username not in owners:
+                results[index] = {
+                    "status": 404,
+                    "msg": "No user found with this username",
+                }
+            elif owners[username]["email"] != email:
+                results[index] = {"status": 401, "msg": "Not Authorized"}
+            elif owners[username].get("deleting"):
+                results[index] = {"status": 409, "msg": "User is being deleted"}
+            else:
+                to_create.append((index, username, title))
+
+        post_ids = create_posts(email, [(u, t) for _, u, t in to_create])
+        for (index, _, _), post_id in zip(to_create, post_ids):
+            results[index] = {"status": 201, "post_id": post_id}
+
+        app.logger.info("Bulk created %s/%s posts", len(post_ids), len(items))
+        return {"results": results, "msg": "success"}, 200
+
+    @token_required
+    @post_namespace.expect(bulk_delete_post_model)
+    @post_namespace.response(200, "Per-item results")
+    @post_namespace.response(400, "Invalid batch")
+    def delete(self):
+        """Delete several posts owned by the caller (any post for admins)"""
+        try:
+            post_ids = [str(post_id) for post_id in get_batch("post_ids")]
+        except ValueError as e:
+            abort(400, str(e))
+        principal = current_principal()
+        owner = None if principal.usertype == "admin" else principal.email
+
+        deleted, forbidden = delete_posts_by_ids(post_ids, email=owner)
+        deleted, forbidden = set(deleted), set(forbidden)
+        results = []
+        for post_id in post_ids:
+            if post_id in deleted:
+                results.append({"post_id": post_id, "status": 204})
+            elif post_id in forbidden:
+                results.append({"post_id": post_id, "status": 401})
+            else:
+                results.append({"post_id": post_id, "status": 404})
+
+        app.logger.info("Bulk deleted %s/%s posts", len(deleted), len(post_ids))
+        return {"results": results, "msg": "success"}, 200
+
+
+post_namespace.add_resource(PostsBulk, "/bulk")
+post_namespace.add_resource(PostsExport, "/export")
+post_namespace.add_resource(PostSearch, "/search")
 post_namespace.add_resource(Post, "/<string:post_id>")
 post_namespace.add_resource(Posts, "/")
@@ -2,20 +2,49 @@ from flask import Flask, abort
 from flask import current_app as app
 from flask import jsonify, request
 from flask_restx import Namespace, Resource, fields
+from pymongo.errors import DuplicateKeyError
 
+from project import deletions
 from project.cruds import (
+    POST_FIELDS,
+    USER_LIST_PROJECTION,
+    USER_UPDATABLE_FIELDS,
     create_post,
     delete_post_by_id,
-    delete_user_by_id,
-    get_all_posts,
-    get_all_users,
+    enqueue_user_deletion,
+    export_users_cursor,
+    find_users_by_username_or_email,
+    get_deletion_job,
     get_post_by_user,
-    get_user_by_email,
     get_user_by_user_id,
-    get_user_by_username,
+    get_user_posts_cursor,
+    get_user_posts_version,
+    get_user_summary,
+    get_user_version,
+    get_users_by_user_ids,
+    get_users_page,
+    search_users,
     update_user,
+    user_posts_version,
+)
+from project.decorator import current_principal, token_required
+from project.streaming import stream_ndjson, stream_page
+from project.utils import (
+    cache_headers,
+    encode_cursor,
+    get_batch,
+    get_fields_arg,
+    get_if_match_version,
+    get_page_args,
+    get_search_args,
+    get_since_arg,
+    is_conditional,
+    last_modified,
+    make_etag,
+    make_listing_etag,
+    not_modified,
+    search_page,
 )
-from project.decorator import token_required
 
 user_namespace = Namespace("users")
 
@@ -31,6 +60,11 @@ user_model = user_namespace.model(
     },
 )
 
+batch_get_user_model = user_namespace.model(
+    "UserIds",
+    {"user_ids": fields.List(fields.String, required=True)},
+)
+
 
 # Upper-Level Resource 1: Users
 
@@ -42,125 +76,168 @@ class UserList(Resource):
     def get(self):
         """Get all users"""
         app.logger.info("Fetching all users")
-        """Get all users with optional query parameters 'name' and 'limit'"""
-        user_type = UserList.get.usertype
-        app.logger.info(user_type)
+        """Get a page of users with optional query parameters 'username', 'limit' and 'next'"""
+        user_type = current_principal().usertype
+        app.logger.info("Listing users for a %s", user_type)
+        name = request.args.get("username")
         try:
-            name = request.args.get("username")
-            limit = request.args.get("limit", type=int)
-
-            users = get_all_users()
-            app.logger.info(f"users: {users}")
-
-            filtered_users = users
-            if name:
-                filtered_users = [user for user in users if name in user["username"]]
-
-            if limit:
-                filtered_users = filtered_users[:limit]
-
-            for user in filtered_users:
-                user["_id"] = str(user["_id"])
-                user["created_on"] = str(user["created_on"])
-
-                del user["password"]
-
-            resp_data = {"data": filtered_users, "msg": "success"}
+            limit, cursor = get_page_args()
+        except ValueError:
+            abort(400, "Invalid cursor")
+        try:
+            users, next_cursor = get_users_page(name, limit, cursor)
+            app.logger.info("users: %s", len(users))
+            resp_data = {
+                "data": users,
+                "next": encode_cursor(*next_cursor) if next_cursor else None,
+                "msg": "success",
+            }
             return resp_data, 200
         except Exception as e:
             return {"Error": e}, 400
 
 
+class UserSearch(Resource):
+    @token_required
+    @user_namespace.response(200, "Matching users")
+    @user_namespace.response(400, "Invalid query parameters")
+    def get(self):
+        """Search users whose username or email starts with 'q' (any case), with 'limit' and 'next'"""
+        try:
+            text, limit, offset = get_search_args()
+        except ValueError as e:
+            abort(400, str(e))
+        users, next_offset = search_users(text, limit, offset)
+        app.logger.info("user search: %s results", len(users))
+        return search_page(users, next_offset), 200
+
+
 class User(Resource):
     @token_required
     # @user_namespace.marshal_with(user_model)
+    @user_namespace.response(304, "User not modified")
     @user_namespace.response(404, "User not found")
     def get(self, user_id):
-        """Get a specific user"""
-        app.logger.info(f"Fetching user {user_id}")
-        user_type = User.get.usertype
+        """Get a specific user, or 304 when If-None-Match / If-Modified-Since still match"""
+        app.logger.info("Fetching user %s", user_id)
+        user_type = current_principal().usertype
+        if is_conditional():
+            meta = get_user_version(user_id)
+            if meta and not_modified(make_etag(meta), last_modified(meta)):
+                return "", 304, cache_headers(make_etag(meta), last_modified(meta))
         user = get_user_by_user_id(user_id)
         if not user:
-            app.logger.warning(f"404 Not Found: User {user_id} not found")
+            app.logger.warning("404 Not Found: User %s not found", user_id)
             abort(404, description=f"User with ID {user_id} not found")
 
         resp_data = {}
         resp_data["user_id"] = user["user_id"]
-        resp_data["created_on"] = str(user["created_on"])
+        resp_data["created_on"] = user["created_on"]
         resp_data["username"] = user["username"]
         resp_data["email"] = user["email"]
 
-        return resp_data, 200
+        return resp_data, 200, cache_headers(make_etag(user), last_modified(user))
 
     @token_required
-    @user_namespace.response(204, "User successfully deleted")
+    @user_namespace.response(202, "User deletion queued")
     def delete(self, user_id):
-        """Delete a specific user"""
-        app.logger.info(f"Deleting user {user_id}")
-        user_type = getattr(self.delete, "usertype", None)
-        app.logger.info(f"User type: {user_type}")
+        """Delete a specific user and its posts, in the background
+
+        Follow the progress at /users/<user_id>/deletion-status.
+        """
+        app.logger.info("Deleting user %s", user_id)
+        user_type = current_principal().usertype
+        app.logger.info("User type: %s", user_type)
 
-        if user_type.lower() != "admin":
+        if not current_principal().is_admin:
             abort(400, "Not Authorized")
 
         user = get_user_by_user_id(user_id)
         if not user:
-            app.logger.warning(f"404 Not Found: User {user_id} not found")
+            app.logger.warning("404 Not Found: User %s not found", user_id)
             abort(404, description=f"User with ID {user_id} not found")
-        result = delete_user_by_id(user_id)
-        app.logger.info(f"User {user_id} deleted")
-        return "", 204
+        job = enqueue_user_deletion(user, current_principal().email)
+        deletions.notify()
+        app.logger.info("Deletion of user %s queued as %s", user_id, job["job_id"])
+        status_url = f"{user_namespace.path}/{user_id}/deletion-status"
+        return {**job, "msg": "deletion queued"}, 202, {"Location": status_url}
 
     @token_required
     @user_namespace.response(200, "User updated successfully")
+    @user_namespace.response(
+        409, "Username or email already taken, or user being deleted"
+    )
+    @user_namespace.response(412, "User was modified by another request")
     def put(self, user_id):
         """Update a specific user"""
-        app.logger.info(f"Updating user {user_id}")
-        email = getattr(self.put, "email", None)
-        usertype = getattr(self.put, "usertype", None)
-        payload = request.get_json()
-        user = get_user_by_user_id(user_id)
-        if not user:
-            app.logger.warning(f"404 Not Found: User {user_id} not found")
-            abort(404, description=f"User with ID {user_id} not found")
-        payload["user_id"] = user_id
+        app.logger.info("Updating user %s", user_id)
+        email = current_principal().email
+        payload = request.get_json() or {}
+        if not any(key in USER_UPDATABLE_FIELDS for key in payload):
+            abort(400, f"Nothing to update, allowed fields: {USER_UPDATABLE_FIELDS}")
+        try:
+            version = get_if_match_version()
+        except ValueError:
+            abort(412, "Malformed If-Match header")
 
-        if user["email"] != email:
-                    return "Not Authorized", 401
+        try:
+            user = update_user(user_id, payload, email=email, version=version)
+        except DuplicateKeyError:
+            abort(409, "User with this username or email already exists")
 
-        if update_user(payload):
+        if not user:
             user = get_user_by_user_id(user_id)
-            resp_data = {}
-            resp_data["user_id"] = user["user_id"]
-            resp_data["created_on"] = str(user["created_on"])
-            resp_data["username"] = user["username"]
-            resp_data["email"] = user["email"]
+            if not user:
+                app.logger.warning("404 Not Found: User %s not found", user_id)
+                abort(404, description=f"User with ID {user_id} not found")
+            if user["email"] != email:
+                return "Not Authorized", 401
+            if user.get("deleting"):
+                abort(409, "User is being deleted")
+            abort(412, "User was modified by another request")
 
-            return resp_data, 200
+        resp_data = {}
+        resp_data["user_id"] = user["user_id"]
+        resp_data["created_on"] = user["created_on"]
+        resp_data["username"] = user["username"]
+        resp_data["email"] = user["email"]
 
-        abort("Something went wrong", 400)
+        return resp_data, 200, {"ETag": make_etag(user)}
 
 
 # # Nested Resource: Posts for a Specific User 1
 class UserPosts(Resource):
     @token_required
+    @user_namespace.response(304, "Posts not modified")
     @user_namespace.response(404, "User not found")
+    @user_namespace.response(400, "Invalid query parameters")
     def get(self, user_id):
-        """Get posts for a specific user"""
-        app.logger.info(f"Fetching posts for user {user_id}")
-        user = get_user_by_user_id(user_id)
-        app.logger.info(f"user: {user}")
+        """Get a page of posts for a specific user
+
+        Optional query parameters: 'limit', 'next', 'since' (ISO 8601, only
+        posts created after it) and 'fields' (comma separated).
+        The ETag changes whenever one of the user's posts is created, updated
+        or deleted.
+        """
+        app.logger.info("Fetching posts for user %s", user_id)
+        try:
+            limit, cursor = get_page_args()
+            since = get_since_arg()
+            fields = get_fields_arg(POST_FIELDS)
+        except ValueError as e:
+            abort(400, str(e))
+        user = get_user_posts_version(user_id)
         if not user:
-            app.logger.warning(f"404 Not Found: User {user_id} not found")
+            app.logger.warning("404 Not Found: User %s not found", user_id)
             abort(404, description=f"User with ID {user_id} not found")
-        username = user["username"]
-        posts = get_all_posts()
-        user_posts = [post for post in posts if post["username"] == username]
-        for post in user_posts:
-            del post["_id"]
-            post["created_on"] = str(post["created_on"])
-        app.logger.info(f"Found posts for user {user_id}: {user_posts}")
-        return user_posts, 200
+        meta = user_posts_version(user)
+        headers = cache_headers(make_listing_etag(meta), meta["updated_on"])
+        if is_conditional() and not_modified(headers["ETag"], meta["updated_on"]):
+            return "", 304, headers
+        posts = get_user_posts_cursor(user["username"], limit, cursor, since, fields)
+        response = stream_page(posts, limit, "post_id", fields)
+        response.headers.update(headers)
+        return response
 
     @token_required
     @user_namespace.response(201, "Post created successfully")
@@ -168,16 +245,19 @@ class UserPosts(Resource):
         """Create a new post"""
         try:
             payload = request.get_json()
-            user_email = getattr(self.post, "email", None)
+            user_email = current_principal().email
             payload["email"] = user_email
             username = payload["username"]
-            app.logger.info(f"payload: {payload}")
+            app.logger.info("payload: %s", payload)
             user = get_user_by_user_id(user_id)
             if not user:
                 return "No user found", 404
+            if user.get("deleting"):
+                return "User is being deleted", 409
             username = user["username"]
 
-            if get_user_by_username(username) and get_user_by_email(user_email):
+            matches = find_users_by_username_or_email(username, user_email)
+            if any(u["email"] == user_email for u in matches):
 
                 post = create_post(user_email, username, payload["title"])
 
@@ -193,8 +273,8 @@ class UserPosts(Resource):
     def delete(self, user_id):
         """delete post"""
         try:
-            email = getattr(self.delete, "email", None)
-            usertype = getattr(self.delete, "usertype", None)
+            email = current_principal().email
+            usertype = current_principal().usertype
 
             user = get_user_by_user_id(user_id)
             if not user:
@@ -205,39 +285,111 @@ class UserPosts(Resource):
             post_id = post["post_id"]
 
             if not post:
-                app.logger.warning(f"404 Not Found")
+                app.logger.warning("404 Not Found")
                 abort(404, description=f"Post not found")
 
             result = delete_post_by_id(post_id)
-            app.logger.info(f"Post {post_id} deleted")
+            app.logger.info("Post %s deleted", post_id)
             return "", 204
 
         except Exception as e:
             abort(400, "Something went wrong")
 
 
+class UserSummary(Resource):
+    @token_required
+    @user_namespace.response(200, "User with its post count")
+    @user_namespace.response(404, "User not found")
+    def get(self, user_id):
+        """Get a user with its post_count and last_post_on, without reading its posts"""
+        summary = get_user_summary(user_id)
+        if not summary:
+            app.logger.warning("404 Not Found: User %s not found", user_id)
+            abort(404, description=f"User with ID {user_id} not found")
+        return summary, 200
+
+
+class UserDeletionStatus(Resource):
+    @token_required
+    @user_namespace.response(200, "Deletion job of the user")
+    @user_namespace.response(404, "No deletion requested for this user")
+    def get(self, user_id):
+        """Status of the deletion of a user: pending, running, done or failed (admin only)"""
+        if not current_principal().is_admin:
+            return "Not Authorized", 401
+        job = get_deletion_job(user_id)
+        if not job:
+            abort(404, description=f"No deletion requested for user {user_id}")
+        return job, 200
+
+
 # HATEOAS Example for User Resource
 class UserLinks(Resource):
     @token_required
     def get(self, user_id):
         """Return HATEOAS links for a specific user"""
-        app.logger.info(f"Fetching HATEOAS links for user {user_id}")
+        app.logger.info("Fetching HATEOAS links for user %s", user_id)
         user = get_user_by_user_id(user_id)
         if not user:
-            app.logger.warning(f"404 Not Found: User {user_id} not found")
+            app.logger.warning("404 Not Found: User %s not found", user_id)
             abort(404, description=f"User with ID {user_id} not found")
 
         links = []
         links.append({"href": f"/users/{user_id}", "rel": "self"})
         links.append({"href": f"/users/{user_id}/posts", "rel": "posts"})
-        user["links"] = links
-        del user["_id"]
-        del user["password"]
-        user["created_on"] = str(user["created_on"])
-        return user, 200
+        data = {k: v for k, v in user.items() if k not in USER_LIST_PROJECTION}
+        data["links"] = links
+        return data, 200
+
+
+class UsersExport(Resource):
+    @token_required
+    @user_namespace.response(200, "NDJSON stream of users")
+    @user_namespace.response(401, "Not Authorized")
+    def get(self):
+        """Export all users as NDJSON (admin only), optionally only those created after 'since'"""
+        if not current_principal().is_admin:
+            return "Not Authorized", 401
+        try:
+            since = get_since_arg()
+        except ValueError as e:
+            abort(400, str(e))
+        app.logger.info("Exporting users since %s", since)
+        batch_size = app.config["EXPORT_BATCH_SIZE"]
+        return stream_ndjson(export_users_cursor(since, batch_size), batch_size)
+
+
+class UserBatchGet(Resource):
+    @token_required
+    @user_namespace.expect(batch_get_user_model)
+    @user_namespace.response(200, "Per-item results")
+    @user_namespace.response(400, "Invalid batch")
+    def post(self):
+        """Get several users by user_id in one call"""
+        try:
+            user_ids = [str(user_id) for user_id in get_batch("user_ids")]
+        except ValueError as e:
+            abort(400, str(e))
+
+        found = {user["user_id"]: user for user in get_users_by_user_ids(user_ids)}
+
+        results = []
+        for user_id in user_ids:
+            if user_id in found:
+                results.append(
+                    {"user_id": user_id, "status": 200, "data": found[user_id]}
+                )
+            else:
+                results.append({"user_id": user_id, "status": 404})
+        return {"results": results, "msg": "success"}, 200
 
 
 user_namespace.add_resource(UserList, "/")
+user_namespace.add_resource(UserBatchGet, "/batch-get")
+user_namespace.add_resource(UsersExport, "/export")
+user_namespace.add_resource(UserSearch, "/search")
 user_namespace.add_resource(User, "/<string:user_id>")
 user_namespace.add_resource(UserPosts, "/<string:user_id>/posts")
 user_namespace.add_resource(UserLinks, "/<string:user_id>/links")
+user_namespace.add_resource(UserSummary, "/<string:user_id>/summary")
+user_namespace.add_resource(UserDeletionStatus, "/<string:user_id>/deletion-status")
@@ -0,0 +1,284 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import bson
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire after a deadline.
+
+    Each process (gunicorn worker, Lambda container) holds its own instance,
+    so nothing is shared between workers and no entry outlives its deadline.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, maxsize, ttl):
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, deadline = entry
+            if deadline <= time.time():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, expires_at=None):
+        """
+        Store `value` for at most `ttl` seconds, and never past `expires_at`
+        (a UNIX timestamp) when given.
+        """
+        deadline = time.time() + self.ttl
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        if self.maxsize <= 0 or deadline <= time.time():
+            return
+        with self._lock:
+            self._data[key] = (value, deadline)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class RedisBackend:
+    """
+    Cache shared by every worker, stored in Redis (or any client exposing
+    get / set(ex=) / delete). Documents are BSON encoded.
+    """
+
+    def __init__(self, client, ttl=300, prefix="cache:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        with self._lock:
+            if raw is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return bson.decode(raw)
+
+    def set(self, key, value, expires_at=None):
+        ttl = self._ttl(expires_at)
+        if ttl > 0:
+            self.client.set(self.prefix + key, bson.encode(value), ex=ttl)
+
+    def add(self, key, value, expires_at=None):
+        """Set `key` only if it does not exist (SET NX); True if it was set."""
+        ttl = self._ttl(expires_at)
+        if ttl <= 0:
+            return False
+        return bool(
+            self.client.set(self.prefix + key, bson.encode(value), ex=ttl, nx=True)
+        )
+
+    def _ttl(self, expires_at):
+        if expires_at is None:
+            return self.ttl
+        return min(self.ttl, math.ceil(expires_at - time.time()))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(key)
+
+    def stats(self):
+        with self._lock:
+            # evictions are done by Redis itself and not visible here
+            return {"hits": self.hits, "misses": self.misses, "evictions": None}
+
+
+class LocalRedis:
+    """
+    In-process stand-in for a Redis client, for tests and local runs. Like
+    Redis it never evicts a key before it expires; expired keys are swept
+    every `sweep_every` writes.
+    """
+
+    def __init__(self, sweep_every=1000):
+        self.sweep_every = sweep_every
+        self._writes = 0
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            value, deadline = self._data.get(name, (None, None))
+            if deadline is not None and deadline <= time.time():
+                del self._data[name]
+                return None
+            return value
+
+    def set(self, name, value, ex=None, nx=False):
+        now = time.time()
+        with self._lock:
+            if nx and name in self._data:
+                deadline = self._data[name][1]
+                if deadline is None or deadline > now:
+                    return None
+            self._data[name] = (value, now + ex if ex else None)
+            self._writes += 1
+            if self._writes % self.sweep_every == 0:
+                self._data = {
+                    key: entry
+                    for key, entry in self._data.items()
+                    if entry[1] is None or entry[1] > now
+                }
+        return True
+
+    def delete(self, *names):
+        with self._lock:
+            return sum(self._data.pop(name, None) is not None for name in names)
+
+    def scan_iter(self, match="*"):
+        prefix = match.rstrip("*")
+        with self._lock:
+            return [name for name in self._data if name.startswith(prefix)]
+
+
+def redis_client(url):
+    if url == "memory://":
+        return LocalRedis()
+    import redis
+
+    return redis.Redis.from_url(url)
+
+
+class Cache:
+    """
+    Read-through cache of documents (dicts) in front of the cruds lookups.
+
+    CACHE_BACKEND selects where entries live:
+      - "local" (default): a TTLCache per worker process. Writes only
+        invalidate the worker that made them, so other workers may serve an
+        entry for up to CACHE_TTL seconds.
+      - "redis": shared by every worker, at CACHE_REDIS_URL
+        ("memory://" uses LocalRedis).
+      - "none": disabled.
+    """
+
+    def __init__(self):
+        self.backend = None
+
+    def init_app(self, app):
+        kind = app.config["CACHE_BACKEND"]
+        ttl = app.config["CACHE_TTL"]
+        if kind == "none":
+            self.backend = None
+        elif kind == "redis":
+            self.backend = RedisBackend(
+                redis_client(app.config["CACHE_REDIS_URL"]), ttl
+            )
+        else:
+            self.backend = TTLCache(app.config["CACHE_SIZE"], ttl)
+
+    def get(self, key):
+        """Return a copy of the cached document, callers are free to mutate it."""
+        if self.backend is None:
+            return None
+        value = self.backend.get(key)
+        return dict(value) if value is not None else None
+
+    def set(self, key, document):
+        if self.backend is not None:
+            self.backend.set(key, dict(document))
+
+    def delete(self, *keys):
+        if self.backend is not None:
+            for key in keys:
+                self.backend.delete(key)
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        return self.backend.stats() if self.backend is not None else {}
+
+
+class Denylist:
+    """
+    Ids (jti) of revoked tokens, each kept until the token it revokes
+    expires, so a lookup is a single O(1) key read.
+
+    REVOCATION_BACKEND selects where they live:
+      - "local" (default): a LocalRedis per worker process. A token revoked
+        in one worker stays valid in the others; only fit for one process.
+      - "redis": shared by every worker, at REVOCATION_REDIS_URL.
+    Entries are never evicted early, unlike the document cache.
+    """
+
+    def __init__(self):
+        self.backend = RedisBackend(LocalRedis(), prefix="revoked:")
+
+    def init_app(self, app):
+        url = "memory://"
+        if app.config["REVOCATION_BACKEND"] == "redis":
+            url = app.config["REVOCATION_REDIS_URL"]
+        self.backend = RedisBackend(
+            redis_client(url), app.config["REFRESH_TOKEN_TTL"], prefix="revoked:"
+        )
+
+    def revoke(self, jti, expires_at):
+        """Deny `jti` until `expires_at` (a UNIX timestamp)."""
+        if jti:
+            self.backend.set(jti, {"exp": expires_at}, expires_at=expires_at)
+
+    def claim(self, jti, expires_at):
+        """
+        Revoke `jti` in one atomic step, unless it already is. Of several
+        concurrent calls for one jti only one gets True.
+        """
+        return bool(jti) and self.backend.add(jti, {"exp": expires_at}, expires_at)
+
+    def is_revoked(self, jti):
+        return bool(jti) and self.backend.get(jti) is not None
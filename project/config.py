@@ -4,7 +4,113 @@ import os
 class BaseConfig:
     SECRET_KEY = os.getenv("SECRET_KEY", "Gr@up7")
     DEBUG = True
-    BCRYPT_LOG_ROUNDS = 13
+    BCRYPT_LOG_ROUNDS = int(os.getenv("BCRYPT_LOG_ROUNDS", 13))
+
+    # bcrypt process pool per worker process (0 hashes inline) and how many
+    # extra hashes may wait for it before signup/login answer 503. Both are
+    # per server worker: by default the cores are shared between the
+    # WEB_CONCURRENCY workers (read by gunicorn and uvicorn).
+    HASHING_WORKERS = int(
+        os.getenv(
+            "HASHING_WORKERS",
+            max(1, (os.cpu_count() or 1) // int(os.getenv("WEB_CONCURRENCY", 1))),
+        )
+    )
+    HASHING_QUEUE_SIZE = int(os.getenv("HASHING_QUEUE_SIZE", 16))
+    HASHING_RETRY_AFTER = int(os.getenv("HASHING_RETRY_AFTER", 1))
+
+    # Access tokens are short-lived; clients renew them at /auth/refresh with
+    # their refresh token, which is rotated (and the old one revoked) each time.
+    ACCESS_TOKEN_TTL = int(os.getenv("ACCESS_TOKEN_TTL", 900))
+    REFRESH_TOKEN_TTL = int(os.getenv("REFRESH_TOKEN_TTL", 14 * 24 * 3600))
+
+    # Logging (project/log.py): "json" or "text" records, written by a
+    # background thread when LOG_ASYNC. LOG_SAMPLE_RATES keeps a share of
+    # the records below WARNING per logger, e.g. "project=0.1".
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+    LOG_ASYNC = os.getenv("LOG_ASYNC", "true").lower() == "true"
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+    LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+
+    # Asymmetric token signing (project/keys.py): a directory of <kid>.pem
+    # keys and the kid that signs. Unset, tokens are HS256 with SECRET_KEY.
+    JWT_KEYS_DIR = os.getenv("JWT_KEYS_DIR")
+    JWT_ACTIVE_KID = os.getenv("JWT_ACTIVE_KID")
+    # Keep accepting HS256 tokens without a kid while migrating to keys. Only
+    # for the migration (at most REFRESH_TOKEN_TTL): anyone with SECRET_KEY
+    # can sign such tokens.
+    JWT_ACCEPT_HS256 = os.getenv("JWT_ACCEPT_HS256", "false").lower() == "true"
+    JWKS_MAX_AGE = int(os.getenv("JWKS_MAX_AGE", 3600))
+
+    # Where revoked token ids are kept until their token expires: "local"
+    # (per worker process, only correct with a single process) or "redis"
+    # (shared, REVOCATION_REDIS_URL).
+    REVOCATION_BACKEND = os.getenv("REVOCATION_BACKEND", "local")
+    REVOCATION_REDIS_URL = os.getenv(
+        "REVOCATION_REDIS_URL", os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+    )
+
+    # Login/signup rate limits (project/ratelimit.py): token buckets per
+    # client IP and per email, then lockouts doubling from LOCKOUT_BASE to
+    # LOCKOUT_MAX seconds. "local" buckets are per worker process; "redis"
+    # shares them (RATELIMIT_REDIS_URL).
+    RATELIMIT_ENABLED = os.getenv("RATELIMIT_ENABLED", "true").lower() == "true"
+    RATELIMIT_BACKEND = os.getenv("RATELIMIT_BACKEND", "local")
+    RATELIMIT_REDIS_URL = os.getenv(
+        "RATELIMIT_REDIS_URL", os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+    )
+    RATELIMIT_IP_BURST = int(os.getenv("RATELIMIT_IP_BURST", 30))
+    RATELIMIT_IP_PER_MINUTE = int(os.getenv("RATELIMIT_IP_PER_MINUTE", 30))
+    RATELIMIT_EMAIL_BURST = int(os.getenv("RATELIMIT_EMAIL_BURST", 5))
+    RATELIMIT_EMAIL_PER_MINUTE = int(os.getenv("RATELIMIT_EMAIL_PER_MINUTE", 3))
+    RATELIMIT_LOCKOUT_BASE = int(os.getenv("RATELIMIT_LOCKOUT_BASE", 1))
+    RATELIMIT_LOCKOUT_MAX = int(os.getenv("RATELIMIT_LOCKOUT_MAX", 900))
+    # Number of proxies (load balancers) in front of the app that append the
+    # client address to X-Forwarded-For. 0 trusts no header: the client IP
+    # is the peer address, which behind a proxy is the proxy's for everyone.
+    PROXY_FIX_X_FOR = int(os.getenv("PROXY_FIX_X_FOR", 0))
+
+    # Verified auth tokens kept per worker process (0 disables the cache).
+    # Entries never outlive the token's `exp`.
+    TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 4096))
+    TOKEN_CACHE_TTL = int(os.getenv("TOKEN_CACHE_TTL", 300))
+
+    # Read-through cache of user/post lookups: "local" (per worker), "redis"
+    # (shared, CACHE_REDIS_URL, "memory://" for an in-process stand-in) or "none"
+    CACHE_BACKEND = os.getenv("CACHE_BACKEND", "local")
+    CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+    CACHE_SIZE = int(os.getenv("CACHE_SIZE", 10000))
+    CACHE_TTL = int(os.getenv("CACHE_TTL", 30))
+
+    # Pagination
+    PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", 20))
+    PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", 100))
+
+    # Maximum number of items accepted by the bulk/batch endpoints
+    BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", 1000))
+    # Larger request bodies are refused with 413, by Flask and the ASGI app
+    MAX_CONTENT_LENGTH = int(os.getenv("MAX_CONTENT_LENGTH", 1024 * 1024))
+
+    # Search: results past SEARCH_MAX_RESULTS are never returned, so one
+    # search reads a bounded number of index entries whatever the data size.
+    SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", 200))
+    SEARCH_MAX_QUERY_LENGTH = int(os.getenv("SEARCH_MAX_QUERY_LENGTH", 100))
+
+    # User deletion jobs (project/jobs.py). DELETION_WORKER: "thread" runs
+    # them in a background thread of each app process, "off" leaves them to
+    # `flask deletion-worker`. Posts are deleted in batches that wait for
+    # DELETION_WRITE_CONCERN, with a pause in between, to spare the primary.
+    DELETION_WORKER = os.getenv("DELETION_WORKER", "thread")
+    DELETION_BATCH_SIZE = int(os.getenv("DELETION_BATCH_SIZE", 500))
+    DELETION_BATCH_PAUSE = float(os.getenv("DELETION_BATCH_PAUSE", 0.1))
+    DELETION_WRITE_CONCERN = os.getenv("DELETION_WRITE_CONCERN", "majority")
+    DELETION_LEASE = int(os.getenv("DELETION_LEASE", 300))
+    DELETION_POLL_INTERVAL = int(os.getenv("DELETION_POLL_INTERVAL", 5))
+    DELETION_MAX_ATTEMPTS = int(os.getenv("DELETION_MAX_ATTEMPTS", 5))
+
+    # Documents fetched per MongoDB round trip by the NDJSON exports
+    EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
 
     # Local
     MONGO_SERVER_NAME = os.getenv("MONGO_SERVER_NAME", "localhost")
@@ -20,3 +126,59 @@ class BaseConfig:
         + MONGO_SERVER_NAME
         + ":27017/task4?authSource=admin"
     )
+
+    # Connection pool and timeouts, per worker process. Size the pool so that
+    # workers * threads never wait on it (see the pool stats at /health).
+    MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 100))
+    MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+    MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", 2000))
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = int(
+        os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000)
+    )
+    MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000))
+    MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 30000))
+    # False defers connecting (and the server monitor threads) to the first
+    # operation instead of app startup.
+    MONGO_CONNECT = os.getenv("MONGO_CONNECT", "true").lower() == "true"
+
+    # Read preference per query class: single document lookups, paginated
+    # listings and NDJSON exports (primary, primaryPreferred, secondary,
+    # secondaryPreferred or nearest).
+    MONGO_READ_PREFERENCES = {
+        "lookup": os.getenv("MONGO_READ_PREFERENCE_LOOKUP", "primary"),
+        "listing": os.getenv("MONGO_READ_PREFERENCE_LISTING", "primary"),
+        "export": os.getenv("MONGO_READ_PREFERENCE_EXPORT", "secondaryPreferred"),
+    }
+
+    # Create the declared indexes (project/indexes.py) when the app starts.
+    # They can also be created with `flask db-indexes`.
+    MONGO_ENSURE_INDEXES = os.getenv("MONGO_ENSURE_INDEXES", "true").lower() == "true"
+
+    # Expose Prometheus metrics on /metrics (needs prometheus_client).
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+    # Serve /swagger.json and the Swagger UI.
+    API_DOCS = os.getenv("API_DOCS", "true").lower() == "true"
+
+    # Register the `flask shell` context.
+    SHELL_CONTEXT = True
+
+
+class LambdaConfig(BaseConfig):
+    """
+    Settings for manage.lambda_handler: nothing that a cold start can skip is
+    done at startup, and nothing that needs more than one process is used.
+    """
+
+    DEBUG = False
+    HASHING_WORKERS = int(os.getenv("HASHING_WORKERS", 0))
+    MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 10))
+    MONGO_CONNECT = False
+    MONGO_ENSURE_INDEXES = os.getenv("MONGO_ENSURE_INDEXES", "false").lower() == "true"
+    METRICS_ENABLED = False
+    # A frozen container would hold queued records back; write them inline.
+    LOG_ASYNC = False
+    # Same for a deletion thread: run `flask deletion-worker` elsewhere.
+    DELETION_WORKER = os.getenv("DELETION_WORKER", "off")
+    API_DOCS = os.getenv("API_DOCS", "false").lower() == "true"
+    SHELL_CONTEXT = False
@@ -0,0 +1,75 @@
+from datetime import datetime
+
+import click
+from pymongo import UpdateOne
+
+from project import cache, mongo
+from project.cruds import posts_changed_update
+
+
+def reconcile_post_counters(db=None, batch_size=1000, dry_run=False):
+    """
+    Recompute post_count / last_post_on of every user from the posts
+    collection with one $group aggregation, and rewrite only the users whose
+    counters drifted (writes that failed half way, posts inserted by other
+    tools, users older than the counters). Returns the number of such users.
+    """
+    db = db if db is not None else mongo.db
+    actual = {
+        group["_id"]: (group["post_count"], group["last_post_on"])
+        for group in db.posts.aggregate(
+            [
+                {
+                    "$group": {
+                        "_id": "$username",
+                        "post_count": {"$sum": 1},
+                        "last_post_on": {"$max": "$created_on"},
+                    }
+                }
+            ],
+            allowDiskUse=True,
+        )
+    }
+    users = db.users.find(
+        {},
+        {"_id": 1, "user_id": 1, "username": 1, "post_count": 1, "last_post_on": 1},
+        batch_size=batch_size,
+    )
+    drifted, requests, cache_keys = 0, [], []
+    now = datetime.now()
+    for user in users:
+        post_count, last_post_on = actual.get(user["username"], (0, None))
+        if (user.get("post_count"), user.get("last_post_on")) == (
+            post_count,
+            last_post_on,
+        ):
+            continue
+        drifted += 1
+        if last_post_on is None:
+            update = {"$set": {"post_count": 0}, "$unset": {"last_post_on": ""}}
+        else:
+            update = {"$set": {"post_count": post_count, "last_post_on": last_post_on}}
+        # the posts changed behind the write paths: new listing validators
+        update.update(posts_changed_update(now))
+        requests.append(UpdateOne({"_id": user["_id"]}, update))
+        cache_keys.append(f"user:{user['user_id']}")
+        if len(requests) >= batch_size:
+            _flush(db, requests, cache_keys, dry_run)
+            requests, cache_keys = [], []
+    _flush(db, requests, cache_keys, dry_run)
+    return drifted
+
+
+def _flush(db, requests, cache_keys, dry_run):
+    if requests and not dry_run:
+        db.users.bulk_write(requests, ordered=False)
+        cache.delete(*cache_keys)
+
+
+@click.command("db-reconcile-counters")
+@click.option("--batch-size", default=1000, show_default=True)
+@click.option("--dry-run", is_flag=True, help="Only count the drifted users.")
+def db_reconcile_counters_command(batch_size, dry_run):
+    """Recompute post_count and last_post_on of every user."""
+    drifted = reconcile_post_counters(batch_size=batch_size, dry_run=dry_run)
+    click.echo(f"users {'to fix' if dry_run else 'fixed'}: {drifted}")
@@ -1,136 +1,765 @@
+import re
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from flask import current_app as app
-
-from project import mongo
-
-mongodb = mongo.db
-
-users = mongodb["users"]
-posts = mongodb["posts"]
+from pymongo import ReturnDocument
+from pymongo.write_concern import WriteConcern
+
+from project import cache
+from project.database import collection
+from project.indexes import unique_indexes_verified, verify_unique_indexes
+
+USER_LIST_PROJECTION = {
+    "_id": 0,
+    "password": 0,
+    "username_lc": 0,
+    "email_lc": 0,
+    "posts_version": 0,
+    "posts_updated_on": 0,
+}
+POST_LIST_PROJECTION = {"_id": 0}
+# Users as cached and returned by id: the password hash is only
+# read on the login path (get_user_by_email), so it never reaches the cache.
+USER_PROJECTION = {"password": 0}
+# What a refresh needs to issue tokens, read uncached so that `deleting`
+# is seen by every worker at once
+TOKEN_USER_PROJECTION = {
+    "user_id": 1,
+    "username": 1,
+    "email": 1,
+    "usertype": 1,
+    "deleting": 1,
+}
+# What the post write paths need to check who owns a username
+OWNER_PROJECTION = {"_id": 0, "user_id": 1, "username": 1, "email": 1, "deleting": 1}
+# What conditional GETs need to compare validators, nothing more
+VERSION_PROJECTION = {"_id": 0, "version": 1, "created_on": 1, "updated_on": 1}
+# ... and what the posts listing of a user needs (see user_posts_version)
+POSTS_VERSION_PROJECTION = {
+    **VERSION_PROJECTION,
+    "username": 1,
+    "posts_version": 1,
+    "posts_updated_on": 1,
+}
+
+# Fields a client may ask for with GET /users/<id>/posts?fields=
+POST_FIELDS = ("post_id", "username", "email", "title", "created_on")
+
+# Fields a PUT may change. Everything else in the payload is ignored.
+USER_UPDATABLE_FIELDS = ("username", "email")
+POST_UPDATABLE_FIELDS = ("title",)
+
+
+def users(query_class="lookup"):
+    return collection("users", query_class)
+
+
+def posts(query_class="lookup"):
+    return collection("posts", query_class)
+
+
+def deletion_jobs(query_class="lookup"):
+    return collection("deletion_jobs", query_class)
 
 
 def signup(email, username, usertype, hashed_password):
-    return users.insert_one(
-        {
-            "user_id": str(uuid.uuid4()),
-            "username": username,
-            "email": email,
-            "password": hashed_password,
-            "created_on": datetime.now(),
-            "usertype": usertype if usertype else "",
-        }
-    )
+    """
+    Insert a new user. Duplicate emails and usernames are rejected by the
+    unique indexes with a DuplicateKeyError (see duplicate_key_field);
+    IndexesMissing is raised instead of inserting while they do not exist.
+    """
+    if not unique_indexes_verified():
+        verify_unique_indexes(users().index_information())
+    return users().insert_one(_new_user(email, username, usertype, hashed_password))
+
+
+def _new_user(email, username, usertype, hashed_password):
+    now = datetime.now()
+    return {
+        "user_id": str(uuid.uuid4()),
+        "username": username,
+        "email": email,
+        "password": hashed_password,
+        "created_on": now,
+        "updated_on": now,
+        "usertype": usertype if usertype else "",
+        "version": 1,
+        "post_count": 0,
+        **search_fields({"username": username, "email": email}),
+    }
+
+
+def search_fields(fields):
+    """Lowercased copies of username / email, matched by the prefix search."""
+    return {
+        f"{key}_lc": fields[key].lower()
+        for key in ("username", "email")
+        if isinstance(fields.get(key), str)
+    }
 
 
 def get_user_by_email(email):
-    return users.find_one({"email": email})
+    """The user with its password hash, for logins; not cached."""
+    # users being deleted can no longer log in or act with their tokens
+    return users().find_one({"email": email, "deleting": {"$ne": True}})
 
 
-def get_user_by_username(username):
-    return users.find_one({"username": username})
+def get_token_user(user_id):
+    """The token claims of a user, uncached (see TOKEN_USER_PROJECTION)."""
+    return users().find_one({"user_id": user_id}, TOKEN_USER_PROJECTION)
 
 
 def get_user_by_user_id(user_id):
-    return users.find_one({"user_id": user_id})
+    user = cache.get(f"user:{user_id}")
+    if user is None:
+        user = users().find_one({"user_id": user_id}, USER_PROJECTION)
+        if user:
+            cache.set(f"user:{user_id}", user)
+    return user
+
+
+def get_user_summary(user_id):
+    """
+    A user with its post_count and last_post_on, read from the user document
+    alone (served from the document cache when warm).
+    """
+    user = get_user_by_user_id(user_id)
+    return user_summary(user) if user else None
+
+
+def user_summary(user):
+    return {
+        "user_id": user["user_id"],
+        "username": user["username"],
+        "usertype": user.get("usertype", ""),
+        "created_on": user["created_on"],
+        "post_count": user.get("post_count", 0),
+        "last_post_on": user.get("last_post_on"),
+    }
+
+
+def get_user_version(user_id):
+    """version / created_on / updated_on of a user, for conditional GETs."""
+    return users().find_one({"user_id": user_id}, VERSION_PROJECTION)
+
+
+def get_user_posts_version(user_id):
+    """
+    username and posts listing validators of a user. Not cached: the
+    per-process cache would keep an old posts_version after a post was
+    written by another worker.
+    """
+    return users().find_one({"user_id": user_id}, POSTS_VERSION_PROJECTION)
+
+
+def export_users_cursor(since=None, batch_size=1000):
+    """Cursor over every user (oldest first, no password), for NDJSON exports."""
+    return _export_cursor(
+        users("export"), "user_id", since, USER_LIST_PROJECTION, batch_size
+    )
+
+
+def get_users_by_user_ids(user_ids):
+    return list(users().find({"user_id": {"$in": user_ids}}, USER_LIST_PROJECTION))
 
 
-def get_user_count_by_email(email):
-    return users.count_documents({"email": email})
+def get_users_by_usernames(usernames):
+    return list(users().find({"username": {"$in": usernames}}, OWNER_PROJECTION))
 
 
-def get_user_count_by_username(username):
-    return users.count_documents({"username": username})
+def find_users_by_username_or_email(username, email):
+    """
+    Fetch, in one query, the users matching `username` or `email`.
+    At most two small documents come back thanks to the unique indexes.
+    """
+    return list(
+        users().find(
+            {"$or": [{"username": username}, {"email": email}]}, OWNER_PROJECTION
+        )
+    )
 
 
-def get_all_users():
-    return list(users.find({}).sort("created_at", -1))
+def duplicate_key_field(error):
+    """Name of the field that caused a DuplicateKeyError ("email", "username"...)."""
+    key_pattern = (error.details or {}).get("keyPattern") or {}
+    if key_pattern:
+        return next(iter(key_pattern))
+    # older servers only name the index: "... index: username_unique dup key ..."
+    match = re.search(r"index: (\S+)", str(error))
+    if match:
+        for field in ("email", "username", "user_id", "post_id"):
+            if match.group(1).startswith(field):
+                return field
+    return None
+
+
+def get_users_page(username=None, limit=20, cursor=None):
+    """Return one page of users, newest first, and the cursor of the next page."""
+    return _paginate(
+        users("listing"),
+        "user_id",
+        _username_prefix(username),
+        USER_LIST_PROJECTION,
+        limit,
+        cursor,
+    )
 
 
 def delete_user_by_id(user_id):
-    result = users.delete_one({"user_id": user_id})
+    result = users().delete_one({"user_id": user_id})
+    cache.delete(f"user:{user_id}")
     if result.deleted_count > 0:
-        app.logger.info(f"User with  {user_id} deleted successfully.")
+        app.logger.info("User with  %s deleted successfully.", user_id)
         return "success"
     else:
-        app.logger.info(f"No user found with id  {user_id}.")
+        app.logger.info("No user found with id  %s.", user_id)
         return "failed"
 
 
-def update_user(data_dict):
-    app.logger.info(f"document update payload: {data_dict}")
-    user_id = data_dict.get("user_id")
-    del data_dict["user_id"]
+# Deletion jobs: one per user, keyed by user_id. pending -> running -> done,
+# or back to pending on an error until DELETION_MAX_ATTEMPTS, then failed.
+# A running job whose lease expired (crashed worker) is claimed again.
+DELETION_JOB_PROJECTION = {"_id": 0, "lease_until": 0}
+
+
+def _new_deletion_job(user, requested_by):
+    now = datetime.now()
+    return {
+        "job_id": str(uuid.uuid4()),
+        "user_id": user["user_id"],
+        "username": user["username"],
+        "requested_by": requested_by,
+        "status": "pending",
+        "created_on": now,
+        "lease_until": now,
+        "attempts": 0,
+        "deleted_posts": 0,
+        "error": None,
+    }
+
+
+def enqueue_user_deletion(user, requested_by):
+    """
+    Queue the deletion of `user` and its posts, or return the job already
+    queued for it (a failed job is queued again). The user is flagged as
+    deleting right away; project.jobs does the actual work.
+    """
+    users().update_one({"user_id": user["user_id"]}, {"$set": {"deleting": True}})
+    cache.delete(f"user:{user['user_id']}")
+    job = deletion_jobs().find_one_and_update(
+        {"user_id": user["user_id"]},
+        {"$setOnInsert": _new_deletion_job(user, requested_by)},
+        projection=DELETION_JOB_PROJECTION,
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    if job["status"] == "failed":
+        retry = {"status": "pending", "attempts": 0, "error": None}
+        deletion_jobs().update_one(
+            {"user_id": user["user_id"], "status": "failed"},
+            {"$set": {**retry, "lease_until": datetime.now()}},
+        )
+        job.update(retry)
+    return job
 
-    for key, val in data_dict.items():
-        users.update_one({"user_id": user_id}, {"$set": {key: val}})
-    return True
 
+def get_deletion_job(user_id):
+    return deletion_jobs().find_one({"user_id": user_id}, DELETION_JOB_PROJECTION)
 
-def create_post(email, username, title):
-    return posts.insert_one(
+
+def claim_deletion_job(lease):
+    """Take the oldest runnable job for `lease` seconds, or return None."""
+    now = datetime.now()
+    return deletion_jobs().find_one_and_update(
+        {"status": {"$in": ["pending", "running"]}, "lease_until": {"$lte": now}},
         {
-            "post_id": str(uuid.uuid4()),
-            "username": username,
-            "email": email,
-            "title": title,
-            "created_on": datetime.now(),
-        }
+            "$set": {
+                "status": "running",
+                "lease_until": now + timedelta(seconds=lease),
+            },
+            "$min": {"started_on": now},
+            "$inc": {"attempts": 1},
+        },
+        sort=[("lease_until", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def delete_user_posts_batch(username, batch_size, write_concern="majority"):
+    """
+    Delete up to `batch_size` posts of `username` with one delete_many that
+    waits for `write_concern`, so a long deletion goes at the pace the
+    replica set can follow. Returns the number of posts found (0 when done).
+    """
+    batch = list(
+        posts().find({"username": username}, {"_id": 1, "post_id": 1}).limit(batch_size)
+    )
+    if batch:
+        concern = WriteConcern(
+            w=int(write_concern) if write_concern.isdigit() else write_concern
+        )
+        posts().with_options(write_concern=concern).delete_many(
+            {"_id": {"$in": [post["_id"] for post in batch]}}
+        )
+        cache.delete(*[f"post:{post['post_id']}" for post in batch])
+    return len(batch)
+
+
+def record_deletion_progress(job_id, deleted, lease):
+    deletion_jobs().update_one(
+        {"job_id": job_id},
+        {
+            "$inc": {"deleted_posts": deleted},
+            "$set": {"lease_until": datetime.now() + timedelta(seconds=lease)},
+        },
+    )
+
+
+def delete_deleting_user(job):
+    """Delete the user document of a deletion job once its posts are gone."""
+    delete_user_by_id(job["user_id"])
+
+
+def close_deletion_job(job):
+    deletion_jobs().update_one(
+        {"job_id": job["job_id"]},
+        {"$set": {"status": "done", "finished_on": datetime.now()}},
+    )
+
+
+def fail_deletion_job(job, error, max_attempts, retry_after):
+    """Queue the job again in `retry_after` seconds, or mark it failed."""
+    status = "failed" if job["attempts"] >= max_attempts else "pending"
+    retry_on = datetime.now() + timedelta(seconds=retry_after)
+    deletion_jobs().update_one(
+        {"job_id": job["job_id"]},
+        {"$set": {"status": status, "error": error, "lease_until": retry_on}},
+    )
+    return status
+
+
+def update_user(user_id, data_dict, email=None, version=None):
+    """
+    Apply the whitelisted fields of `data_dict` in a single atomic update and
+    return the updated document.
+
+    Returns None when no document matched: unknown user, `email` given and not
+    the owner's, `version` given and no longer current, or user being deleted.
+    A new username or email is copied to the user's posts.
+    """
+    query, update = _update_spec(
+        {"user_id": user_id, "deleting": {"$ne": True}},
+        USER_UPDATABLE_FIELDS,
+        data_dict,
+        email,
+        version,
+    )
+    before = users().find_one_and_update(
+        query, update, return_document=ReturnDocument.BEFORE
+    )
+    cache.delete(f"user:{user_id}")
+    if before is None:
+        return None
+    user = _updated_document(before, update)
+    owner_update = _posts_owner_update(before, user)
+    if owner_update:
+        owned = {"username": before["username"]}
+        post_ids = posts().distinct("post_id", owned)
+        posts().update_many(owned, owner_update)
+        cache.delete(*[f"post:{post_id}" for post_id in post_ids])
+    return user
+
+
+def _updated_document(before, update):
+    """The document `_update_spec`'s update turns `before` into."""
+    return {**before, **update["$set"], "version": (before.get("version") or 0) + 1}
+
+
+def _posts_owner_update(before, user):
+    """
+    The update that copies a changed username / email of `user` to its posts,
+    which are listed and deleted by username; None when neither changed.
+    """
+    changed = {
+        key: user[key] for key in ("username", "email") if user[key] != before[key]
+    }
+    if not changed:
+        return None
+    return {
+        "$inc": {"version": 1},
+        "$set": {**changed, "updated_on": user["updated_on"]},
+    }
+
+
+def update_user_password(user_id, hashed_password):
+    result = users().update_one(
+        {"user_id": user_id}, {"$set": {"password": hashed_password}}
+    )
+    cache.delete(f"user:{user_id}")
+    return result
+
+
+def _new_post(email, username, title):
+    now = datetime.now()
+    return {
+        "post_id": str(uuid.uuid4()),
+        "username": username,
+        "email": email,
+        "title": title,
+        "created_on": now,
+        "updated_on": now,
+        "version": 1,
+    }
+
+
+def create_post(email, username, title):
+    post = _new_post(email, username, title)
+    result = posts().insert_one(post)
+    _count_posts(username, posts_added_update(1, post["created_on"]))
+    return result
+
+
+def create_posts(email, items):
+    """
+    Insert several posts with a single insert_many.
+    `items` is a list of (username, title); returns the new post ids in order.
+    """
+    docs = [_new_post(email, username, title) for username, title in items]
+    if docs:
+        posts().insert_many(docs, ordered=False)
+    for username, (count, last_post_on) in _group_by_author(docs).items():
+        _count_posts(username, posts_added_update(count, last_post_on))
+    return [doc["post_id"] for doc in docs]
+
+
+def _group_by_author(docs):
+    """{username: (number of docs, latest created_on)} of a list of posts."""
+    groups = {}
+    for doc in docs:
+        count, last = groups.get(doc["username"], (0, None))
+        created_on = doc.get("created_on")
+        if last is None or (created_on and created_on > last):
+            last = created_on
+        groups[doc["username"]] = (count + 1, last)
+    return groups
+
+
+def posts_added_update(count, last_post_on):
+    """Update of the author's counters after `count` of its posts were created."""
+    return {
+        "$inc": {"post_count": count, "posts_version": 1},
+        "$max": {"last_post_on": last_post_on, "posts_updated_on": last_post_on},
+    }
+
+
+def posts_removed_update(count, latest):
+    """
+    Update of the author's counters after `count` of its posts were deleted;
+    `latest` is its newest remaining post, if any.
+    """
+    update = posts_changed_update(datetime.now())
+    update["$inc"]["post_count"] = -count
+    if latest:
+        update["$set"] = {"last_post_on": latest["created_on"]}
+    else:
+        update["$unset"] = {"last_post_on": ""}
+    return update
+
+
+def posts_changed_update(updated_on):
+    """Update of the author's posts version after one of its posts changed."""
+    return {"$inc": {"posts_version": 1}, "$max": {"posts_updated_on": updated_on}}
+
+
+def _count_posts(username, update):
+    # post_count / last_post_on / posts_version are not part of the user's
+    # version: they change with every post and must not fail the author's
+    # If-Match.
+    user = users().find_one_and_update(
+        {"username": username}, update, projection={"_id": 0, "user_id": 1}
+    )
+    if user:
+        cache.delete(f"user:{user['user_id']}")
+
+
+def _latest_post(username):
+    return posts().find_one(
+        {"username": username}, {"_id": 0, "created_on": 1}, sort=[("created_on", -1)]
     )
 
 
 def get_post_by_email(email):
-    return posts.find_one({"email": email})
+    return posts().find_one({"email": email})
 
 
 def get_post_by_post_id(post_id):
-    return posts.find_one({"post_id": post_id})
+    post = cache.get(f"post:{post_id}")
+    if post is None:
+        post = posts().find_one({"post_id": post_id})
+        if post:
+            cache.set(f"post:{post_id}", post)
+    return post
+
+
+def get_post_version(post_id):
+    """version / created_on / updated_on of a post, for conditional GETs."""
+    return posts().find_one({"post_id": post_id}, VERSION_PROJECTION)
+
+
+def user_posts_version(user):
+    """
+    Validators of the posts listing of `user`, from the user document alone:
+    posts_version is bumped whenever one of its posts is created, updated or
+    deleted, and version when the user changes (a rename rewrites its posts).
+    """
+    moments = (user.get("posts_updated_on"), user.get("updated_on"))
+    return {
+        "version": user.get("version", 0),
+        "posts_version": user.get("posts_version", 0),
+        "updated_on": max((m for m in moments if m), default=user.get("created_on")),
+    }
 
 
 def get_post_by_user(username):
-    return posts.find_one({"username": username})
+    return posts().find_one({"username": username})
+
+
+def get_posts_page(username=None, limit=20, cursor=None):
+    """Return one page of posts, newest first, and the cursor of the next page."""
+    return _paginate(
+        posts("listing"),
+        "post_id",
+        _username_prefix(username),
+        POST_LIST_PROJECTION,
+        limit,
+        cursor,
+    )
+
+
+def search_posts(text, limit=20, offset=0):
+    """
+    Posts matching the words of `text` through the title text index, best
+    match first. Returns one page and the offset of the next one.
+    """
+    query, projection, sort = _post_search_spec(text)
+    docs = posts("listing").find(query, projection).sort(sort)
+    return _split_search(list(docs.skip(offset).limit(limit + 1)), limit, offset)
+
+
+def search_users(text, limit=20, offset=0):
+    """
+    Users whose username or email starts with `text`, case-insensitively:
+    the username matches by username, then the email-only matches by email.
+    Each branch is one query on its own index (username_lc / email_lc),
+    limited to the results up to the end of the page.
+    """
+    wanted = offset + limit + 1
+    docs = []
+    for query, projection, sort in _user_search_specs(text):
+        cursor = users("listing").find(query, projection).sort(sort)
+        docs += cursor.limit(wanted - len(docs))
+        if len(docs) >= wanted:
+            break
+    return _split_search(docs[offset:], limit, offset)
+
+
+def _post_search_spec(text):
+    score = {"$meta": "textScore"}
+    projection = {**POST_LIST_PROJECTION, "score": score}
+    return (
+        {"$text": {"$search": text}},
+        projection,
+        [("score", score), ("created_on", -1)],
+    )
 
 
-def update_post(data_dict):
-    app.logger.info(f"document update payload: {data_dict}")
-    post_id = data_dict.get("user_id")
-    del data_dict["post_id"]
+def _user_search_specs(text):
+    # Not one $or sorted by username: its email branch could not use an
+    # index for that sort.
+    prefix = re.compile(f"^{re.escape(text.lower())}")
+    return [
+        (
+            {"username_lc": prefix},
+            USER_LIST_PROJECTION,
+            [("username_lc", 1), ("user_id", 1)],
+        ),
+        (
+            {"email_lc": prefix, "username_lc": {"$not": prefix}},
+            USER_LIST_PROJECTION,
+            [("email_lc", 1)],
+        ),
+    ]
+
+
+def _split_search(docs, limit, offset):
+    next_offset = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        if offset + limit < app.config["SEARCH_MAX_RESULTS"]:
+            next_offset = offset + limit
+    return docs, next_offset
+
+
+def _username_prefix(username):
+    if not username:
+        return {}
+    return {"username": {"$regex": f"^{re.escape(username)}"}}
+
+
+def export_posts_cursor(since=None, batch_size=1000):
+    """Cursor over every post (oldest first), for NDJSON exports."""
+    return _export_cursor(
+        posts("export"), "post_id", since, POST_LIST_PROJECTION, batch_size
+    )
 
-    for key, val in data_dict.items():
-        posts.update_one({"post_id": post_id}, {"$set": {key: val}})
-    return True
 
+def _export_cursor(collection, key, since, projection, batch_size):
+    query = {"created_on": {"$gt": since}} if since else {}
+    return (
+        collection.find(query, projection)
+        .sort([("created_on", 1), (key, 1)])
+        .batch_size(batch_size)
+    )
 
-def get_all_posts():
-    return list(posts.find({}).sort("created_at", -1))
 
+def get_user_posts_cursor(username, limit=20, cursor=None, since=None, fields=None):
+    """
+    Cursor over one page of a user's posts, newest first, served by the
+    (username, created_on, post_id) index. It yields up to limit + 1 posts;
+    the extra one only tells that a next page exists.
+
+    `since` keeps posts created after that datetime, `fields` restricts the
+    projection (created_on and post_id are always returned for the cursor).
+    """
+    query, projection = _user_posts_query(username, since, fields)
+    return _page_cursor(posts("listing"), "post_id", query, projection, limit, cursor)
+
+
+def _user_posts_query(username, since, fields):
+    query = {"username": username}
+    if since:
+        query["created_on"] = {"$gt": since}
+    projection = {"_id": 0}
+    if fields:
+        projection = {field: 1 for field in {*fields, "created_on", "post_id"}}
+        projection["_id"] = 0
+    return query, projection
+
+
+def _paginate(collection, key, query, projection, limit, cursor):
+    """
+    Keyset pagination on (created_on, key), both descending.
+
+    One extra document is fetched to know whether a next page exists, so the
+    cost of a call depends on the page size only.
+    """
+    docs = list(_page_cursor(collection, key, query, projection, limit, cursor))
+    return _split_page(docs, key, limit)
+
+
+def _split_page(docs, key, limit):
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = (docs[-1]["created_on"], docs[-1][key])
+    return docs, next_cursor
+
+
+def _page_cursor(collection, key, query, projection, limit, cursor):
+    if cursor:
+        created_on, last_key = cursor
+        query = {
+            "$and": [
+                query,
+                {
+                    "$or": [
+                        {"created_on": {"$lt": created_on}},
+                        {"created_on": created_on, key: {"$lt": last_key}},
+                    ]
+                },
+            ]
+        }
+    return (
+        collection.find(query, projection)
+        .sort([("created_on", -1), (key, -1)])
+        .limit(limit + 1)
+    )
 
-def delete_post_by_id(post_id):
-    result = posts.delete_one({"post_id": post_id})
-    if result.deleted_count > 0:
-        app.logger.info(f"User with  {post_id} deleted successfully.")
-        return "success"
-    else:
-        app.logger.info(f"No post found with id  {post_id}.")
-        return "failed"
+
+def delete_posts_by_ids(post_ids, email=None):
+    """
+    Delete the given posts in one delete_many. When `email` is given only the
+    posts it owns are deleted.
+    Returns (deleted_ids, forbidden_ids); ids in neither were not found.
+    """
+    found = posts().find(
+        {"post_id": {"$in": post_ids}},
+        {"_id": 0, "post_id": 1, "email": 1, "username": 1},
+    )
+    deleted, forbidden, authors = [], [], []
+    for post in found:
+        if email is None or post["email"] == email:
+            deleted.append(post["post_id"])
+            authors.append(post)
+        else:
+            forbidden.append(post["post_id"])
+    if deleted:
+        posts().delete_many({"post_id": {"$in": deleted}})
+        cache.delete(*[f"post:{post_id}" for post_id in deleted])
+    for username, (count, _) in _group_by_author(authors).items():
+        _count_posts(username, posts_removed_update(count, _latest_post(username)))
+    return deleted, forbidden
+
+
+def update_post(post_id, data_dict, email=None, version=None):
+    """Same as update_user, for posts."""
+    post = _update(
+        posts(),
+        f"post:{post_id}",
+        {"post_id": post_id},
+        POST_UPDATABLE_FIELDS,
+        data_dict,
+        email,
+        version,
+    )
+    if post:
+        _count_posts(post["username"], posts_changed_update(post["updated_on"]))
+    return post
 
 
-def update_post(data_dict):
-    app.logger.info(f"document update payload: {data_dict}")
-    post_id = data_dict.get("post_id")
-    del data_dict["post_id"]
+def _update(collection, cache_key, query, allowed, data_dict, email, version):
+    query, update = _update_spec(query, allowed, data_dict, email, version)
+    document = collection.find_one_and_update(
+        query, update, return_document=ReturnDocument.AFTER
+    )
+    cache.delete(cache_key)
+    return document
+
 
-    for key, val in data_dict.items():
-        posts.update_one({"post_id": post_id}, {"$set": {key: val}})
-    return True
+def _update_spec(query, allowed, data_dict, email, version):
+    app.logger.info("document update payload: %s", data_dict)
+    fields = {key: val for key, val in data_dict.items() if key in allowed}
+    fields.update(search_fields(fields))
+    if email is not None:
+        query["email"] = email
+    if version is not None:
+        # documents written before versioning have no version field
+        query["version"] = version if version else {"$in": [0, None]}
+    update = {"$inc": {"version": 1}, "$set": {**fields, "updated_on": datetime.now()}}
+    return query, update
 
 
 def delete_post_by_id(post_id):
-    result = posts.delete_one({"post_id": post_id})
-    if result.deleted_count > 0:
-        app.logger.info(f"Post with  {post_id} deleted successfully.")
+    post = posts().find_one_and_delete(
+        {"post_id": post_id}, projection={"_id": 0, "username": 1}
+    )
+    cache.delete(f"post:{post_id}")
+    if post:
+        username = post["username"]
+        _count_posts(username, posts_removed_update(1, _latest_post(username)))
+        app.logger.info("Post with  %s deleted successfully.", post_id)
         return "success"
     else:
-        app.logger.info(f"No user found with id  {post_id}.")
+        app.logger.info("No user found with id  %s.", post_id)
         return "failed"
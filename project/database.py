@@ -0,0 +1,151 @@
+import threading
+import time
+
+from flask import current_app as app
+from pymongo import ReadPreference
+from pymongo.monitoring import ConnectionPoolListener
+
+from project import mongo
+from project.metrics import command_timer
+
+READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+
+
+class PoolMonitor(ConnectionPoolListener):
+    """
+    Connection pool counters for the MongoDB client of this process:
+    connections open / checked out, checkout wait times and checkouts that
+    failed because the pool was exhausted (waitQueueTimeoutMS) or the
+    server was unreachable.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.open = 0
+            self.checked_out = 0
+            self.max_checked_out = 0
+            self.checkouts = 0
+            self.checkout_failures = {}
+            self.wait_seconds_total = 0.0
+            self.wait_seconds_max = 0.0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open -= 1
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        waited = self._waited()
+        with self._lock:
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def connection_check_out_failed(self, event):
+        self._waited()
+        with self._lock:
+            reason = str(event.reason)
+            self.checkout_failures[reason] = self.checkout_failures.get(reason, 0) + 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def _waited(self):
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+        return time.perf_counter() - started if started else 0.0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "open": self.open,
+                "checked_out": self.checked_out,
+                "max_checked_out": self.max_checked_out,
+                "checkouts": self.checkouts,
+                "checkout_failures": dict(self.checkout_failures),
+                "wait_ms_avg": (
+                    round(1000 * self.wait_seconds_total / self.checkouts, 3)
+                    if self.checkouts
+                    else 0.0
+                ),
+                "wait_ms_max": round(1000 * self.wait_seconds_max, 3),
+            }
+
+
+pool_monitor = PoolMonitor()
+
+
+def client_options(config):
+    """Keyword arguments of the MongoClient (or Motor client) built from config."""
+    return {
+        "maxPoolSize": config["MONGO_MAX_POOL_SIZE"],
+        "minPoolSize": config["MONGO_MIN_POOL_SIZE"],
+        "waitQueueTimeoutMS": config["MONGO_WAIT_QUEUE_TIMEOUT_MS"],
+        "serverSelectionTimeoutMS": config["MONGO_SERVER_SELECTION_TIMEOUT_MS"],
+        "connectTimeoutMS": config["MONGO_CONNECT_TIMEOUT_MS"],
+        "socketTimeoutMS": config["MONGO_SOCKET_TIMEOUT_MS"],
+        "connect": config["MONGO_CONNECT"],
+        "event_listeners": [pool_monitor, command_timer],
+    }
+
+
+def get_collection(db, name, query_class="lookup"):
+    """
+    The collection `name` of `db`, a PyMongo or Motor database, with the read
+    preference MONGO_READ_PREFERENCES sets for `query_class` ("lookup",
+    "listing" or "export").
+    """
+    mode = app.config["MONGO_READ_PREFERENCES"].get(query_class, "primary")
+    if mode == "primary":
+        return db[name]
+    return db.get_collection(name, read_preference=READ_PREFERENCES[mode])
+
+
+def collection(name, query_class="lookup"):
+    """
+    get_collection() of the Flask-PyMongo database. Resolved on every call,
+    so the client may be created after import.
+    """
+    return get_collection(mongo.db, name, query_class)
+
+
+def ping():
+    """Round trip to the server; returns the latency in milliseconds."""
+    started = time.perf_counter()
+    mongo.db.command("ping")
+    return round(1000 * (time.perf_counter() - started), 3)
@@ -2,26 +2,50 @@ from functools import wraps
 
 from flask import abort
 from flask import current_app as app
-from flask import request
+from flask import g, request
 
 from project.utils import decode_auth_token
 
 
+class Principal:
+    """
+    The authenticated caller of the current request, built from the token
+    claims without reading MongoDB.
+    """
+
+    def __init__(self, claims):
+        self.claims = claims
+        self.email = claims.get("email")
+        self.usertype = claims.get("usertype")
+
+    @property
+    def is_admin(self):
+        return (self.usertype or "").lower() == "admin"
+
+
+def current_principal():
+    """Return the Principal of the current request, or None."""
+    return g.get("principal")
+
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        auth_token = request.headers.get("Authorization")
-        if not auth_token:
-            abort(401, "Token Required")
-        elif auth_token:
-            token = auth_token.split(" ")[1]
-        payload = decode_auth_token(token)
-        if payload == "expired":
-            abort(401, "Expired Token")
-        elif payload == "invalid":
-            abort(401, "Invalid Token")
-        setattr(decorated, "email", payload["email"])
-        setattr(decorated, "usertype", payload["usertype"])
+        if current_principal() is None:
+            auth_token = request.headers.get("Authorization")
+            if not auth_token:
+                abort(401, "Token Required")
+            parts = auth_token.split(" ")
+            if len(parts) != 2:
+                abort(401, "Invalid Token")
+            payload = decode_auth_token(parts[1])
+            if payload == "expired":
+                abort(401, "Expired Token")
+            elif payload == "invalid":
+                abort(401, "Invalid Token")
+            elif payload == "revoked":
+                abort(401, "Revoked Token")
+            g.principal = Principal(payload)
         return f(*args, **kwargs)
 
     return decorated
@@ -0,0 +1,111 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+from project.metrics import BCRYPT_SECONDS, timed
+
+
+class HashingBusy(Exception):
+    """Raised when every hashing slot is taken; the client should retry later."""
+
+    def __init__(self, retry_after):
+        super().__init__("Password hashing is saturated")
+        self.retry_after = retry_after
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode()
+
+
+def _check(pw_hash, password):
+    return bcrypt.checkpw(password, pw_hash)
+
+
+class HashingPool:
+    """
+    Runs bcrypt in a dedicated process pool so that a slow hash does not hold
+    the GIL of the request worker.
+
+    At most HASHING_WORKERS + HASHING_QUEUE_SIZE hashes are in flight per
+    worker process; past that HashingBusy is raised instead of queueing. A
+    host runs HASHING_WORKERS bcrypt processes per server worker.
+    HASHING_WORKERS = 0 hashes in the calling thread (e.g. on Lambda, where
+    process pools are not available).
+    """
+
+    def __init__(self):
+        self.rounds = 12
+        self.workers = 0
+        self.retry_after = 1
+        self._slots = threading.BoundedSemaphore(1)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.rounds = app.config["BCRYPT_LOG_ROUNDS"]
+        self.workers = app.config["HASHING_WORKERS"]
+        self.retry_after = app.config["HASHING_RETRY_AFTER"]
+        self._slots = threading.BoundedSemaphore(
+            max(self.workers, 1) + app.config["HASHING_QUEUE_SIZE"]
+        )
+
+    def _get_executor(self):
+        # Created lazily, and again after a fork, so that every gunicorn
+        # worker owns its pool.
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ProcessPoolExecutor(
+                        self.workers, mp_context=multiprocessing.get_context("spawn")
+                    )
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy(self.retry_after)
+        try:
+            if self.workers <= 0:
+                return fn(*args)
+            return self._get_executor().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    async def _run_async(self, fn, *args):
+        # Same as _run without blocking the event loop (ASGI mode).
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy(self.retry_after)
+        try:
+            if self.workers <= 0:
+                return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+            return await asyncio.wrap_future(self._get_executor().submit(fn, *args))
+        finally:
+            self._slots.release()
+
+    def generate_password_hash(self, password):
+        with timed(BCRYPT_SECONDS, operation="hash"):
+            return self._run(_hash, password.encode(), self.rounds)
+
+    def check_password_hash(self, pw_hash, password):
+        with timed(BCRYPT_SECONDS, operation="check"):
+            return self._run(_check, pw_hash.encode(), password.encode())
+
+    async def generate_password_hash_async(self, password):
+        with timed(BCRYPT_SECONDS, operation="hash"):
+            return await self._run_async(_hash, password.encode(), self.rounds)
+
+    async def check_password_hash_async(self, pw_hash, password):
+        with timed(BCRYPT_SECONDS, operation="check"):
+            return await self._run_async(_check, pw_hash.encode(), password.encode())
+
+    def needs_rehash(self, pw_hash):
+        """True when `pw_hash` was made with a cost other than BCRYPT_LOG_ROUNDS."""
+        try:
+            return int(pw_hash.split("$")[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
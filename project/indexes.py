@@ -0,0 +1,162 @@
+import click
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure, PyMongoError
+
+from project import mongo
+
+# Every index the application relies on, per collection. Names are explicit
+# so that the check below can compare what exists with what is declared.
+INDEXES = {
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+        IndexModel(
+            [("created_on", DESCENDING), ("user_id", DESCENDING)],
+            name="created_on_user_id",
+        ),
+        # case-insensitive prefix search (cruds.search_users)
+        IndexModel(
+            [("username_lc", ASCENDING), ("user_id", ASCENDING)],
+            name="username_lc_user_id",
+        ),
+        IndexModel([("email_lc", ASCENDING)], name="email_lc"),
+    ],
+    "posts": [
+        IndexModel([("post_id", ASCENDING)], name="post_id_unique", unique=True),
+        IndexModel(
+            [
+                ("username", ASCENDING),
+                ("created_on", DESCENDING),
+                ("post_id", DESCENDING),
+            ],
+            name="username_created_on",
+        ),
+        IndexModel(
+            [("created_on", DESCENDING), ("post_id", DESCENDING)],
+            name="created_on_post_id",
+        ),
+        IndexModel([("title", TEXT)], name="title_text"),
+    ],
+    "deletion_jobs": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+        IndexModel(
+            [("status", ASCENDING), ("lease_until", ASCENDING)],
+            name="status_lease_until",
+        ),
+    ],
+}
+
+# Signup relies on these to reject duplicate emails and usernames.
+UNIQUE_USER_INDEXES = [
+    model.document["name"] for model in INDEXES["users"] if model.document.get("unique")
+]
+
+_unique_indexes_verified = False
+
+
+class IndexesMissing(Exception):
+    """Raised when a unique index the write paths rely on does not exist."""
+
+    def __init__(self, names):
+        super().__init__(f"Missing unique indexes on users: {', '.join(names)}")
+        self.names = names
+
+
+def unique_indexes_verified():
+    return _unique_indexes_verified
+
+
+def verify_unique_indexes(index_information):
+    """
+    Raise IndexesMissing unless `index_information` (of the users collection)
+    has every unique users index. Once they are found, this process does not
+    check again.
+    """
+    global _unique_indexes_verified
+    missing = [
+        name
+        for name in UNIQUE_USER_INDEXES
+        if not index_information.get(name, {}).get("unique")
+    ]
+    if missing:
+        raise IndexesMissing(missing)
+    _unique_indexes_verified = True
+
+
+def ensure_indexes(db=None):
+    """
+    Create every declared index. Safe to call repeatedly: MongoDB skips
+    indexes that already exist with the same definition.
+    Returns the list of created index names per collection.
+    """
+    db = db if db is not None else mongo.db
+    created = {}
+    for collection, models in INDEXES.items():
+        created[collection] = db[collection].create_indexes(models)
+    return created
+
+
+def check_indexes(db=None):
+    """
+    Compare the declared indexes with the ones present in the database.
+
+    Returns a dict per collection with:
+      - missing: declared but not present
+      - undeclared: present but not declared (apart from `_id_`)
+      - unused: present but never used since the last server restart
+    """
+    db = db if db is not None else mongo.db
+    report = {}
+    for collection, models in INDEXES.items():
+        declared = {model.document["name"] for model in models}
+        existing = set(db[collection].index_information()) - {"_id_"}
+        try:
+            stats = db[collection].aggregate([{"$indexStats": {}}])
+            unused = sorted(
+                stat["name"]
+                for stat in stats
+                if stat["name"] != "_id_" and stat["accesses"]["ops"] == 0
+            )
+        except OperationFailure:
+            # $indexStats needs the clusterMonitor role
+            unused = None
+        report[collection] = {
+            "missing": sorted(declared - existing),
+            "undeclared": sorted(existing - declared),
+            "unused": unused,
+        }
+    return report
+
+
+def init_indexes(app):
+    """
+    Create indexes at startup when MONGO_ENSURE_INDEXES is enabled, and fail
+    the startup when they cannot be built. Without it, signups check the
+    unique indexes instead (see cruds.signup).
+    """
+    if not app.config.get("MONGO_ENSURE_INDEXES"):
+        return
+    try:
+        ensure_indexes()
+        verify_unique_indexes(mongo.db.users.index_information())
+    except PyMongoError as e:
+        raise RuntimeError(f"Index creation failed: {e}") from e
+
+
+@click.command("db-indexes")
+@click.option("--check", is_flag=True, help="Only report missing or unused indexes.")
+def db_indexes_command(check):
+    """Create the declared MongoDB indexes, or check them with --check."""
+    if not check:
+        for collection, names in ensure_indexes().items():
+            click.echo(f"{collection}: {', '.join(names)}")
+
+    for collection, result in check_indexes().items():
+        click.echo(f"{collection}:")
+        click.echo(f"  missing: {', '.join(result['missing']) or '-'}")
+        click.echo(f"  undeclared: {', '.join(result['undeclared']) or '-'}")
+        if result["unused"] is None:
+            click.echo("  unused: unknown (no permission for $indexStats)")
+        else:
+            click.echo(f"  unused: {', '.join(result['unused']) or '-'}")
@@ -0,0 +1,125 @@
+import os
+import threading
+import time
+
+import click
+
+
+class DeletionWorker:
+    """
+    Runs the queued user deletions (cruds.enqueue_user_deletion): the posts
+    of the user are deleted DELETION_BATCH_SIZE at a time, each batch waiting
+    for DELETION_WRITE_CONCERN and followed by DELETION_BATCH_PAUSE seconds,
+    then the user document itself.
+
+    With DELETION_WORKER = "thread" each process starts a daemon thread on
+    its first request, which also picks up the jobs left pending or running
+    by processes that stopped. With "off" jobs wait for `flask deletion-worker`.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.mode = "off"
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.mode = app.config["DELETION_WORKER"]
+        if self.mode == "thread":
+            # not at import time: gunicorn may fork after creating the app
+            app.before_request(self.start)
+        self.batch_size = app.config["DELETION_BATCH_SIZE"]
+        self.pause = app.config["DELETION_BATCH_PAUSE"]
+        self.write_concern = app.config["DELETION_WRITE_CONCERN"]
+        self.lease = app.config["DELETION_LEASE"]
+        self.poll_interval = app.config["DELETION_POLL_INTERVAL"]
+        self.max_attempts = app.config["DELETION_MAX_ATTEMPTS"]
+
+    def start(self):
+        """Start the worker thread of this process if it is not running."""
+        # Once per pid, so again after a fork, like the hashing pool.
+        if self.mode != "thread" or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._thread = threading.Thread(
+                    target=self.serve, name="deletion-worker", daemon=True
+                )
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def notify(self):
+        """Wake the worker thread after a job was queued."""
+        if self.mode == "thread":
+            self.start()
+            self._wake.set()
+
+    def serve(self, once=False):
+        """Run jobs as they come; with `once`, until none is left."""
+        while True:
+            try:
+                self.run_pending()
+            except Exception:
+                # keep the thread alive, the job is retried once its lease expires
+                self.app.logger.exception("Deletion worker error")
+            if once:
+                return
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def run_pending(self):
+        """Claim and run jobs until none is runnable; returns how many ran."""
+        from project import cruds
+
+        count = 0
+        with self.app.app_context():
+            while True:
+                job = cruds.claim_deletion_job(self.lease)
+                if job is None:
+                    return count
+                self.run(job)
+                count += 1
+
+    def run(self, job):
+        from project import cruds
+
+        logger = self.app.logger
+        logger.info("Deleting user %s (attempt %s)", job["user_id"], job["attempts"])
+        try:
+            self._delete_posts(job)
+            cruds.delete_deleting_user(job)
+            # posts written by requests that read the user before it was
+            # flagged as deleting
+            self._delete_posts(job)
+            cruds.close_deletion_job(job)
+            logger.info("User %s deleted", job["user_id"])
+        except Exception as e:
+            # any error counts as an attempt, so DELETION_MAX_ATTEMPTS applies
+            status = cruds.fail_deletion_job(
+                job, str(e), self.max_attempts, self.poll_interval * job["attempts"]
+            )
+            logger.exception("Deletion of user %s %s: %s", job["user_id"], status, e)
+
+    def _delete_posts(self, job):
+        from project import cruds
+
+        while True:
+            deleted = cruds.delete_user_posts_batch(
+                job["username"], self.batch_size, self.write_concern
+            )
+            if not deleted:
+                return
+            cruds.record_deletion_progress(job["job_id"], deleted, self.lease)
+            time.sleep(self.pause)
+
+
+@click.command("deletion-worker")
+@click.option("--once", is_flag=True, help="Exit when no job is left.")
+def deletion_worker_command(once):
+    """Run the queued user deletions in this process."""
+    from project import deletions
+
+    deletions.serve(once=once)
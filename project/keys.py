@@ -0,0 +1,149 @@
+"""
+Signing keys of the auth tokens.
+
+Without JWT_KEYS_DIR tokens are HS256 with SECRET_KEY. With it, every
+`<kid>.pem` file in the directory is a key: RSA keys sign RS256, Ed25519 keys
+EdDSA. JWT_ACTIVE_KID names the one that signs (by default the last private
+key in kid order, e.g. with date based kids); the others only verify, so a
+key can be published (jwks.json) before it signs and kept after it stops, for
+as long as tokens it signed are alive. A file holding only a public key can
+verify but never sign.
+
+Keys are parsed once at startup; requests only do dict lookups.
+"""
+
+import hashlib
+import json
+import os
+
+import click
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+from flask.cli import with_appcontext
+from jwt.algorithms import OKPAlgorithm, RSAAlgorithm
+
+LEGACY_ALGORITHM = "HS256"
+
+
+class SigningKey:
+    def __init__(self, kid, key):
+        self.kid = kid
+        if isinstance(key, (rsa.RSAPrivateKey, rsa.RSAPublicKey)):
+            self.algorithm, exporter = "RS256", RSAAlgorithm
+        elif isinstance(key, (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey)):
+            self.algorithm, exporter = "EdDSA", OKPAlgorithm
+        else:
+            raise ValueError(f"Unsupported key type for kid {kid}")
+        if hasattr(key, "public_key"):
+            self.private_key, self.public_key = key, key.public_key()
+        else:
+            self.private_key, self.public_key = None, key
+        self.jwk = {
+            **exporter.to_jwk(self.public_key, as_dict=True),
+            "kid": kid,
+            "alg": self.algorithm,
+            "use": "sig",
+        }
+
+
+def _load_key(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    try:
+        return serialization.load_pem_private_key(data, password=None)
+    except ValueError:
+        return serialization.load_pem_public_key(data)
+
+
+class KeyRing:
+    def __init__(self):
+        self.secret = None
+        self.keys = {}
+        self.active = None
+        self.accept_legacy = False
+        self.jwks = b'{"keys": []}'
+        self.jwks_etag = None
+
+    def init_app(self, app):
+        self.secret = app.config["SECRET_KEY"]
+        self.accept_legacy = app.config["JWT_ACCEPT_HS256"]
+        self.keys = {}
+        self.active = None
+        keys_dir = app.config["JWT_KEYS_DIR"]
+        if keys_dir:
+            for name in sorted(os.listdir(keys_dir)):
+                if name.endswith(".pem"):
+                    kid = name[: -len(".pem")]
+                    self.keys[kid] = SigningKey(
+                        kid, _load_key(os.path.join(keys_dir, name))
+                    )
+            active = app.config["JWT_ACTIVE_KID"] or max(
+                (kid for kid, key in self.keys.items() if key.private_key), default=None
+            )
+            if active is None:
+                app.logger.warning("No private key in %s, signing HS256", keys_dir)
+            elif active not in self.keys or self.keys[active].private_key is None:
+                raise RuntimeError(f"No private key for JWT_ACTIVE_KID {active!r}")
+            else:
+                self.active = self.keys[active]
+                if self.accept_legacy:
+                    app.logger.warning(
+                        "JWT_ACCEPT_HS256 is set: HS256 tokens are still accepted"
+                    )
+        self.jwks = json.dumps(
+            {"keys": [key.jwk for key in self.keys.values()]}, sort_keys=True
+        ).encode()
+        self.jwks_etag = hashlib.sha256(self.jwks).hexdigest()[:16]
+
+    def encode(self, payload):
+        if self.active is None:
+            return jwt.encode(payload, self.secret, algorithm=LEGACY_ALGORITHM)
+        return jwt.encode(
+            payload,
+            self.active.private_key,
+            algorithm=self.active.algorithm,
+            headers={"kid": self.active.kid},
+        )
+
+    def decode(self, token):
+        """Verify `token` with the key its header names. Raises jwt errors."""
+        header = jwt.get_unverified_header(token)
+        kid = header.get("kid")
+        if kid is not None and not isinstance(kid, str):
+            raise jwt.InvalidTokenError("Invalid kid")
+        key = self.keys.get(kid)
+        if key is not None:
+            return jwt.decode(token, key.public_key, algorithms=[key.algorithm])
+        if self.active is None or (self.accept_legacy and "kid" not in header):
+            return jwt.decode(token, self.secret, algorithms=[LEGACY_ALGORITHM])
+        raise jwt.InvalidTokenError("Unknown signing key")
+
+
+@click.command("jwt-keygen")
+@click.argument("kid")
+@click.option(
+    "--type", "key_type", type=click.Choice(["rsa", "ed25519"]), default="ed25519"
+)
+@with_appcontext
+def jwt_keygen_command(kid, key_type):
+    """Write a new private key <kid>.pem into JWT_KEYS_DIR."""
+    from flask import current_app as app
+
+    keys_dir = app.config["JWT_KEYS_DIR"]
+    if not keys_dir:
+        raise click.UsageError("JWT_KEYS_DIR is not set")
+    if key_type == "rsa":
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    else:
+        key = ed25519.Ed25519PrivateKey.generate()
+    path = os.path.join(keys_dir, f"{kid}.pem")
+    with open(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "wb") as f:
+        f.write(
+            key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption(),
+            )
+        )
+    click.echo(f"Wrote {path}")
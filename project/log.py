@@ -0,0 +1,160 @@
+"""
+Logging pipeline of the app logger.
+
+Request threads only filter (level, sampling) and enqueue the record with
+its arguments unformatted; a QueueListener thread formats it (JSON or
+text), redacts tokens, password hashes and secrets, and writes it. Log
+calls should pass %-style arguments (`app.logger.info("user %s", user_id)`)
+so that nothing is formatted for records that are dropped.
+"""
+
+import atexit
+import json
+import logging
+import queue
+import random
+import re
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from flask.logging import default_handler
+
+REDACTED = "[REDACTED]"
+SECRET_KEYS = "password|auth_token|refresh_token|token|secret|secret_key"
+_PATTERNS = [
+    # JWTs
+    re.compile(r"eyJ[\w-]+\.eyJ[\w-]+\.[\w-]*"),
+    # bcrypt hashes
+    re.compile(r"\$2[abxy]?\$\d{2}\$[./A-Za-z0-9]{53}"),
+]
+# 'password': '...' in dict reprs and "password": "..." in JSON
+_SECRET_VALUES = re.compile(
+    rf"""(['"](?:{SECRET_KEYS})['"]\s*:\s*)(['"])(?:\\.|(?!\2).)*\2""", re.IGNORECASE
+)
+# Attributes of every LogRecord; anything else was passed with extra=
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_listener = None
+
+
+def redact(text):
+    for pattern in _PATTERNS:
+        text = pattern.sub(REDACTED, text)
+    return _SECRET_VALUES.sub(rf"\1\2{REDACTED}\2", text)
+
+
+class RedactingFormatter(logging.Formatter):
+    def format(self, record):
+        return redact(super().format(record))
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; `extra=` fields become top-level keys."""
+
+    def format(self, record):
+        data = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": redact(record.getMessage()),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc_info"] = redact(record.exc_text)
+        return redact(json.dumps(data, default=str))
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep a share of the records below WARNING per logger name, e.g.
+    {"project": 0.1} keeps one INFO record of the app in ten.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(record.name, 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    Enqueues records as they are. The stock QueueHandler formats the message
+    in the calling thread (so that records can be pickled); an in-process
+    queue does not need that. A full queue drops the record.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        if record.exc_info:
+            # Tracebacks reference live frames; render them now.
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _parse_sample_rates(value):
+    """'project=0.1,werkzeug=0.5' -> {"project": 0.1, "werkzeug": 0.5}"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, rate = item.partition("=")
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+def init_app(app):
+    global _listener
+    config = app.config
+    if config["LOG_FORMAT"] == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = RedactingFormatter(
+            "[%(asctime)s] %(levelname)s in %(module)s: %(message)s"
+        )
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(formatter)
+
+    shutdown()
+    if config["LOG_ASYNC"]:
+        log_queue = queue.Queue(config["LOG_QUEUE_SIZE"])
+        handler = LazyQueueHandler(log_queue)
+        _listener = QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.unregister(shutdown)
+        atexit.register(shutdown)
+    else:
+        handler = output
+    handler.addFilter(SamplingFilter(_parse_sample_rates(config["LOG_SAMPLE_RATES"])))
+
+    app.logger.removeHandler(default_handler)
+    for old in [h for h in app.logger.handlers if getattr(h, "_project_log", False)]:
+        app.logger.removeHandler(old)
+    handler._project_log = True
+    app.logger.addHandler(handler)
+    app.logger.setLevel(config["LOG_LEVEL"])
+
+
+def shutdown():
+    """Flush the queue; call before the process exits."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
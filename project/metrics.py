@@ -0,0 +1,233 @@
+"""
+Prometheus metrics: request counts and latency per route, the time spent
+in MongoDB commands, bcrypt and JWT encode/decode, and gauges of the
+document cache, the token cache and the MongoDB connection pool.
+
+prometheus_client is optional; without it every metric is a no-op and
+/metrics is not registered. Under gunicorn set PROMETHEUS_MULTIPROC_DIR
+(see gunicorn.conf.py) so that /metrics aggregates every worker.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+
+from flask import Response, g, request
+from pymongo.monitoring import CommandListener
+
+try:
+    import prometheus_client
+except ImportError:  # pragma: no cover
+    prometheus_client = None
+
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+# How often a worker copies its cache / pool counters into the gauges.
+STATS_INTERVAL = 1.0
+
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def observe(self, amount):
+        pass
+
+    def set(self, value):
+        pass
+
+
+def _metric(kind, name, documentation, labels, **kwargs):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return getattr(prometheus_client, kind)(name, documentation, labels, **kwargs)
+
+
+REQUESTS = _metric(
+    "Counter",
+    "http_requests_total",
+    "HTTP requests by route, method and status",
+    ["namespace", "endpoint", "method", "status"],
+)
+REQUEST_SECONDS = _metric(
+    "Histogram",
+    "http_request_duration_seconds",
+    "Time to build the HTTP response, by route and method",
+    ["namespace", "endpoint", "method"],
+)
+MONGO_SECONDS = _metric(
+    "Histogram",
+    "mongodb_command_duration_seconds",
+    "MongoDB command round trips, by command",
+    ["command", "outcome"],
+    buckets=FAST_BUCKETS,
+)
+BCRYPT_SECONDS = _metric(
+    "Histogram",
+    "bcrypt_duration_seconds",
+    "bcrypt hash/check time, including the wait for the hashing pool",
+    ["operation"],
+)
+JWT_SECONDS = _metric(
+    "Histogram",
+    "jwt_duration_seconds",
+    "JWT encode/decode time (decode only on token cache misses)",
+    ["operation"],
+    buckets=FAST_BUCKETS,
+)
+
+# Gauges are per worker process (a pid label under PROMETHEUS_MULTIPROC_DIR);
+# hits / misses / evictions / checkouts count since the worker started.
+CACHE_SIZE = _metric(
+    "Gauge",
+    "cache_size",
+    "Entries in an in-process cache",
+    ["cache"],
+    multiprocess_mode="liveall",
+)
+CACHE_HITS = _metric(
+    "Gauge", "cache_hits", "Cache hits", ["cache"], multiprocess_mode="liveall"
+)
+CACHE_MISSES = _metric(
+    "Gauge", "cache_misses", "Cache misses", ["cache"], multiprocess_mode="liveall"
+)
+CACHE_EVICTIONS = _metric(
+    "Gauge",
+    "cache_evictions",
+    "Entries evicted before they expired (in-process caches only)",
+    ["cache"],
+    multiprocess_mode="liveall",
+)
+POOL_CONNECTIONS = _metric(
+    "Gauge",
+    "mongodb_pool_connections",
+    "MongoDB pool connections: open, checked out, most checked out at once",
+    ["state"],
+    multiprocess_mode="liveall",
+)
+POOL_CHECKOUTS = _metric(
+    "Gauge",
+    "mongodb_pool_checkouts",
+    "MongoDB pool checkouts, by outcome",
+    ["outcome"],
+    multiprocess_mode="liveall",
+)
+POOL_WAIT_SECONDS = _metric(
+    "Gauge",
+    "mongodb_pool_wait_seconds",
+    "Wait for a MongoDB pool connection: average and maximum",
+    ["stat"],
+    multiprocess_mode="liveall",
+)
+
+
+@contextmanager
+def timed(histogram, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(**labels).observe(time.perf_counter() - started)
+
+
+class CommandTimer(CommandListener):
+    """Feeds the duration of every MongoDB command to MONGO_SECONDS."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_SECONDS.labels(event.command_name, "success").observe(
+            event.duration_micros / 1e6
+        )
+
+    def failed(self, event):
+        MONGO_SECONDS.labels(event.command_name, "failure").observe(
+            event.duration_micros / 1e6
+        )
+
+
+command_timer = CommandTimer()
+
+
+def _labels():
+    rule = request.url_rule.rule if request.url_rule else None
+    namespace = rule.strip("/").split("/")[0] if rule else "unmatched"
+    return namespace or "root", request.endpoint or "unmatched", request.method
+
+
+def export_stats():
+    """Copy the cache and pool counters of this process into the gauges."""
+    from project import cache, token_cache
+    from project.database import pool_monitor
+
+    for name, stats in (("documents", cache.stats()), ("tokens", token_cache.stats())):
+        for gauge, key in (
+            (CACHE_SIZE, "size"),
+            (CACHE_HITS, "hits"),
+            (CACHE_MISSES, "misses"),
+            (CACHE_EVICTIONS, "evictions"),
+        ):
+            if stats.get(key) is not None:
+                gauge.labels(name).set(stats[key])
+    pool = pool_monitor.stats()
+    for state in ("open", "checked_out", "max_checked_out"):
+        POOL_CONNECTIONS.labels(state).set(pool[state])
+    POOL_CHECKOUTS.labels("success").set(pool["checkouts"])
+    POOL_CHECKOUTS.labels("failure").set(sum(pool["checkout_failures"].values()))
+    POOL_WAIT_SECONDS.labels("avg").set(pool["wait_ms_avg"] / 1000)
+    POOL_WAIT_SECONDS.labels("max").set(pool["wait_ms_max"] / 1000)
+
+
+_stats_exported = 0.0
+
+
+def _before_request():
+    g.request_started = time.perf_counter()
+
+
+def _after_request(response):
+    started = g.pop("request_started", None)
+    if started is not None and request.endpoint != "metrics":
+        namespace, endpoint, method = _labels()
+        REQUEST_SECONDS.labels(namespace, endpoint, method).observe(
+            time.perf_counter() - started
+        )
+        REQUESTS.labels(namespace, endpoint, method, str(response.status_code)).inc()
+    _maybe_export_stats()
+    return response
+
+
+def _maybe_export_stats():
+    # Every worker refreshes its own gauges as it serves requests, since the
+    # /metrics request only reaches one of them.
+    global _stats_exported
+    now = time.monotonic()
+    if now - _stats_exported >= STATS_INTERVAL:
+        _stats_exported = now
+        export_stats()
+
+
+def _metrics_view():
+    export_stats()
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return Response(
+        prometheus_client.generate_latest(registry),
+        mimetype=prometheus_client.CONTENT_TYPE_LATEST,
+    )
+
+
+def init_app(app):
+    if not app.config["METRICS_ENABLED"] or prometheus_client is None:
+        return
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.add_url_rule("/metrics", "metrics", _metrics_view)
@@ -0,0 +1,117 @@
+"""
+Rate limiting of the credential endpoints (login, signup).
+
+Each client IP and each email gets a token bucket. When a bucket runs dry
+the key is locked out for RATELIMIT_LOCKOUT_BASE seconds, doubling on every
+further lockout up to RATELIMIT_LOCKOUT_MAX. Lockouts are forgotten after a
+quiet period. The check costs a couple of dict lookups and runs before the
+user lookup and bcrypt, so rejected attempts cost next to nothing.
+"""
+
+import math
+import threading
+import time
+from contextlib import nullcontext
+
+from project.caching import RedisBackend, redis_client
+
+
+class RateLimited(Exception):
+    """Raised when a client must wait `retry_after` seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__("Too many attempts")
+        self.retry_after = retry_after
+
+
+class Bucket:
+    def __init__(self, burst, per_minute):
+        self.burst = burst
+        self.rate = per_minute / 60.0
+
+
+class RateLimiter:
+    """
+    RATELIMIT_BACKEND selects where the buckets live: "local" (per worker
+    process, the default) or "redis" (shared, RATELIMIT_REDIS_URL). With
+    Redis the read-modify-write is not atomic across workers, so a burst of
+    concurrent attempts may get a few more through than the bucket holds;
+    it is not locked within a process either, so that no thread holds a
+    lock across a Redis round trip.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.store = None
+        self.buckets = {}
+        self.lockout_base = 1
+        self.lockout_max = 900
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config["RATELIMIT_ENABLED"]
+        self.buckets = {
+            "ip": Bucket(
+                config["RATELIMIT_IP_BURST"], config["RATELIMIT_IP_PER_MINUTE"]
+            ),
+            "email": Bucket(
+                config["RATELIMIT_EMAIL_BURST"], config["RATELIMIT_EMAIL_PER_MINUTE"]
+            ),
+        }
+        self.lockout_base = config["RATELIMIT_LOCKOUT_BASE"]
+        self.lockout_max = config["RATELIMIT_LOCKOUT_MAX"]
+        url = "memory://"
+        if config["RATELIMIT_BACKEND"] == "redis":
+            url = config["RATELIMIT_REDIS_URL"]
+        # Keep state long enough to refill any bucket and to remember strikes.
+        ttl = max(
+            [self.lockout_max, 1]
+            + [math.ceil(b.burst / b.rate) for b in self.buckets.values() if b.rate]
+        )
+        self.store = RedisBackend(redis_client(url), 2 * ttl, prefix="ratelimit:")
+        self._lock = threading.Lock() if url == "memory://" else nullcontext()
+
+    def check(self, ip=None, email=None):
+        """Take a token for `ip` and `email`; raise RateLimited when out."""
+        if not self.enabled:
+            return
+        if ip:
+            self._take("ip", ip)
+        if email:
+            self._take("email", str(email).strip().lower())
+
+    def reset(self, email):
+        """Forget the strikes of `email`, e.g. after a successful login."""
+        if self.enabled and email:
+            self.store.delete(f"email:{str(email).strip().lower()}")
+
+    def _take(self, scope, value):
+        bucket = self.buckets[scope]
+        key = f"{scope}:{value}"
+        now = time.time()
+        with self._lock:
+            state = self.store.get(key) or {
+                "tokens": float(bucket.burst),
+                "at": now,
+                "strikes": 0,
+                "locked_until": 0.0,
+            }
+            if state["locked_until"] > now:
+                raise RateLimited(math.ceil(state["locked_until"] - now))
+            tokens = min(
+                bucket.burst, state["tokens"] + (now - state["at"]) * bucket.rate
+            )
+            state["at"] = now
+            if tokens >= 1:
+                state["tokens"] = tokens - 1
+                self.store.set(key, state)
+                return
+            state["tokens"] = tokens
+            state["strikes"] += 1
+            lockout = min(
+                self.lockout_base * 2 ** min(state["strikes"] - 1, 32), self.lockout_max
+            )
+            state["locked_until"] = now + lockout
+            self.store.set(key, state)
+        raise RateLimited(math.ceil(lockout))
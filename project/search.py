@@ -0,0 +1,42 @@
+import click
+from pymongo import UpdateOne
+
+from project import mongo
+from project.cruds import search_fields
+
+
+def backfill_search_fields(db=None, batch_size=1000):
+    """
+    Set username_lc / email_lc on the users written before the prefix search
+    existed, `batch_size` users per bulk write. Lowercasing is done here and
+    not with $toLower, which only handles ASCII, so that the backfilled
+    values match the ones the write paths store. Safe to run repeatedly.
+    Returns the number of updated users.
+    """
+    db = db if db is not None else mongo.db
+    missing = db.users.find(
+        {
+            "$or": [
+                {"username_lc": {"$exists": False}},
+                {"email_lc": {"$exists": False}},
+            ]
+        },
+        {"_id": 1, "username": 1, "email": 1},
+        batch_size=batch_size,
+    )
+    updated, requests = 0, []
+    for user in missing:
+        requests.append(UpdateOne({"_id": user["_id"]}, {"$set": search_fields(user)}))
+        if len(requests) >= batch_size:
+            updated += db.users.bulk_write(requests, ordered=False).modified_count
+            requests = []
+    if requests:
+        updated += db.users.bulk_write(requests, ordered=False).modified_count
+    return updated
+
+
+@click.command("db-backfill-search")
+@click.option("--batch-size", default=1000, show_default=True)
+def db_backfill_search_command(batch_size):
+    """Add the lowercased search fields to existing users."""
+    click.echo(f"users updated: {backfill_search_fields(batch_size=batch_size)}")
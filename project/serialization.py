@@ -0,0 +1,29 @@
+"""
+JSON encoding of API responses.
+
+Uses orjson when it is installed and the stdlib json otherwise; both write
+datetimes as ISO 8601 and ObjectIds as strings, so handlers can return
+documents straight from MongoDB projections without converting fields.
+"""
+
+import json
+from datetime import date, datetime
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def _default(obj):
+    # Only reached for types the encoder has no native support for.
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    return str(obj)
+
+
+def dumps(data):
+    """Encode `data` to JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, default=_default, separators=(",", ":")).encode()
@@ -0,0 +1,55 @@
+from flask import Response, stream_with_context
+
+from project.serialization import dumps
+from project.utils import encode_cursor
+
+
+def stream_page(cursor, limit, key, fields=None):
+    """
+    Stream a page read from a MongoDB cursor of up to limit + 1 documents as
+    {"data": [...], "next": <cursor>, "msg": "success"}, one document at a
+    time instead of building the whole body in memory.
+
+    `key` is the tie-breaker field of the pagination cursor and `fields`, if
+    given, the only fields written for each document.
+    """
+
+    def generate():
+        yield b'{"data":['
+        last, has_more = None, False
+        try:
+            for count, doc in enumerate(cursor):
+                if count == limit:
+                    has_more = True
+                    break
+                item = doc if not fields else {f: doc[f] for f in fields if f in doc}
+                yield (b"," if last is not None else b"") + dumps(item)
+                last = doc
+        finally:
+            cursor.close()
+        next_cursor = encode_cursor(last["created_on"], last[key]) if has_more else None
+        yield b'],"next":' + dumps(next_cursor) + b',"msg":"success"}'
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+
+def stream_ndjson(cursor, batch_size):
+    """
+    Stream every document of `cursor` as newline delimited JSON, writing
+    `batch_size` lines per chunk so memory stays flat whatever the size.
+    """
+
+    def generate():
+        lines = []
+        try:
+            for doc in cursor:
+                lines.append(dumps(doc))
+                if len(lines) >= batch_size:
+                    yield b"\n".join(lines) + b"\n"
+                    lines = []
+        finally:
+            cursor.close()
+        if lines:
+            yield b"\n".join(lines) + b"\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
@@ -1,38 +1,287 @@
+import base64
+import hashlib
+import json
 import os
-from datetime import datetime, timedelta
+import uuid
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
 
 import jwt
 from flask import current_app as app
 from flask import request
 
+from project import denylist, keyring, token_cache
+from project.metrics import JWT_SECONDS, timed
 
-def encode_auth_token(email, usertype, name, _id):
+
+def encode_auth_token(email, usertype, name, _id, user_id=None):
     try:
         payload = {
-            "exp": datetime.utcnow() + timedelta(days=0, seconds=3600),
+            "exp": datetime.utcnow()
+            + timedelta(seconds=app.config["ACCESS_TOKEN_TTL"]),
             "iat": datetime.utcnow(),
+            "jti": uuid.uuid4().hex,
+            "type": "access",
             "sub": _id,
             "name": name,
             "email": email,
             "usertype": usertype,
+            "user_id": user_id,
         }
-        token = jwt.encode(payload, app.config["SECRET_KEY"], algorithm="HS256")
+        with timed(JWT_SECONDS, operation="encode"):
+            token = keyring.encode(payload)
 
-        app.logger.info(token)
         return token
     except Exception as e:
         return e
 
 
-def decode_auth_token(token):
-    app.logger.info(app.config.get("SECRET_KEY"))
+def encode_refresh_token(user_id):
+    """
+    Long-lived token whose only use is to get a new access token (and a new
+    refresh token) from /auth/refresh.
+    """
+    payload = {
+        "exp": datetime.utcnow() + timedelta(seconds=app.config["REFRESH_TOKEN_TTL"]),
+        "iat": datetime.utcnow(),
+        "jti": uuid.uuid4().hex,
+        "type": "refresh",
+        "user_id": user_id,
+    }
+    with timed(JWT_SECONDS, operation="encode"):
+        return keyring.encode(payload)
+
+
+def decode_auth_token(token, token_type="access"):
+    """
+    Verify a token and return its payload, or "expired" / "invalid" /
+    "revoked". A token of another type than `token_type` is "invalid";
+    tokens issued before types existed are access tokens.
+
+    Verified payloads are cached by token digest until the token expires, so
+    a client reusing its token skips the signature check. The denylist is
+    checked on every call.
+    """
+    cache_key = hashlib.sha256(token.encode()).hexdigest()
+    payload = token_cache.get(cache_key)
+    if payload is None:
+        try:
+            with timed(JWT_SECONDS, operation="decode"):
+                payload = keyring.decode(token)
+        except jwt.ExpiredSignatureError as e:
+            return "expired"
+        except jwt.InvalidTokenError as e:
+            return "invalid"
+        token_cache.set(cache_key, payload, expires_at=payload.get("exp"))
+    if payload.get("type", "access") != token_type:
+        return "invalid"
+    if denylist.is_revoked(payload.get("jti")):
+        return "revoked"
+    return dict(payload)
+
+
+def revoke_token(payload):
+    """Revoke a decoded token until it expires (logout, refresh rotation)."""
+    denylist.revoke(payload.get("jti"), payload.get("exp"))
+
+
+def claim_token(payload):
+    """
+    Revoke a single-use token (a refresh token) and tell whether this call
+    did: a token presented twice at once is only honoured once.
+    """
+    return denylist.claim(payload.get("jti"), payload.get("exp"))
+
+
+def encode_cursor(created_on, key):
+    """Build an opaque pagination cursor from the last item of a page."""
+    raw = json.dumps([created_on.isoformat(), key]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor. Raises ValueError on a malformed cursor."""
     try:
-        payload = jwt.decode(
-            token, app.config.get("SECRET_KEY"), algorithms="HS256", verify=True
+        created_on, key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_on), str(key)
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def get_page_args():
+    """Read the `limit` and `next` query parameters of a listing request."""
+    limit = request.args.get("limit", app.config["PAGE_SIZE_DEFAULT"], type=int)
+    limit = max(1, min(limit, app.config["PAGE_SIZE_MAX"]))
+    cursor = request.args.get("next")
+    return limit, decode_cursor(cursor) if cursor else None
+
+
+def parse_search_args(args, config):
+    """
+    Read the `q`, `limit` and `next` (offset) parameters of a search from a
+    mapping of query parameters. The page is shortened so that no result
+    past SEARCH_MAX_RESULTS is read. Raises ValueError on invalid values.
+    """
+    text = (args.get("q") or "").strip()
+    if not text:
+        raise ValueError("'q' is required")
+    if len(text) > config["SEARCH_MAX_QUERY_LENGTH"]:
+        raise ValueError(
+            f"'q' is limited to {config['SEARCH_MAX_QUERY_LENGTH']} characters"
         )
-        # app.logger.info(f"decoded value: {payload}")
-        return payload
-    except jwt.ExpiredSignatureError as e:
-        return "expired"
-    except jwt.InvalidTokenError as e:
-        return "invalid"
+    try:
+        limit = int(args.get("limit", config["PAGE_SIZE_DEFAULT"]))
+        offset = int(args.get("next", 0))
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid limit or cursor") from e
+    if not 0 <= offset < config["SEARCH_MAX_RESULTS"]:
+        raise ValueError(
+            f"Only the first {config['SEARCH_MAX_RESULTS']} results are returned"
+        )
+    limit = max(1, min(limit, config["PAGE_SIZE_MAX"]))
+    return text, min(limit, config["SEARCH_MAX_RESULTS"] - offset), offset
+
+
+def get_search_args():
+    """parse_search_args for the current flask request."""
+    return parse_search_args(request.args, app.config)
+
+
+def search_page(docs, next_offset):
+    """Body of a search response; `next` is null past the last result."""
+    return {
+        "data": docs,
+        "next": str(next_offset) if next_offset is not None else None,
+        "msg": "success",
+    }
+
+
+def make_etag(document):
+    """ETag of a user or post document, derived from its version counter."""
+    return f'"{document.get("version", 0)}"'
+
+
+def last_modified(document):
+    """When a document last changed; documents older than updated_on fall back to created_on."""
+    return document.get("updated_on") or document.get("created_on")
+
+
+def make_listing_etag(meta):
+    """
+    Weak ETag of a user's posts listing, from the user's version and posts
+    version (see cruds.user_posts_version).
+    """
+    return f'W/"{meta["version"]}-{meta["posts_version"]}"'
+
+
+def http_date(moment):
+    """Format a datetime for Last-Modified. Naive datetimes are local time."""
+    return format_datetime(moment.astimezone(timezone.utc), usegmt=True)
+
+
+def cache_headers(etag, modified):
+    """Validator headers of a conditional GET response."""
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if modified:
+        headers["Last-Modified"] = http_date(modified)
+    return headers
+
+
+def is_not_modified(etag, modified, if_none_match, if_modified_since):
+    """
+    Whether a GET carrying these If-None-Match / If-Modified-Since values can
+    be answered with 304. If-None-Match wins when both are sent (RFC 9110)
+    and uses the weak comparison; Last-Modified has a one second precision.
+    """
+    if if_none_match:
+        if if_none_match.strip() == "*":
+            return True
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return etag.removeprefix("W/") in tags
+    if if_modified_since and modified:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            return False
+        return int(modified.astimezone(timezone.utc).timestamp()) <= since.timestamp()
+    return False
+
+
+def is_conditional():
+    """Whether the current request carries If-None-Match or If-Modified-Since."""
+    return "If-None-Match" in request.headers or "If-Modified-Since" in request.headers
+
+
+def not_modified(etag, modified):
+    """is_not_modified for the current flask request."""
+    return is_not_modified(
+        etag,
+        modified,
+        request.headers.get("If-None-Match"),
+        request.headers.get("If-Modified-Since"),
+    )
+
+
+def get_if_match_version():
+    """
+    Return the version expected by the If-Match header, or None when the
+    header is absent or "*". Raises ValueError on a malformed header.
+    """
+    if_match = request.headers.get("If-Match")
+    if not if_match or if_match.strip() == "*":
+        return None
+    tag = if_match.strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    return int(tag.strip('"'))
+
+
+def get_batch(key):
+    """
+    Read the list `key` from the JSON body of a bulk request.
+    Raises ValueError when it is missing, empty or larger than BULK_MAX_ITEMS.
+    """
+    items = (request.get_json(silent=True) or {}).get(key)
+    if not isinstance(items, list) or not items:
+        raise ValueError(f"'{key}' must be a non-empty list")
+    if len(items) > app.config["BULK_MAX_ITEMS"]:
+        raise ValueError(f"At most {app.config['BULK_MAX_ITEMS']} items per request")
+    return items
+
+
+def check_batch_items(items, names):
+    """
+    Raise ValueError unless every bulk item is an object whose `names`
+    fields, when present, are strings.
+    """
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ValueError(f"Item {index} must be an object")
+        for name in names:
+            if name in item and not isinstance(item[name], str):
+                raise ValueError(f"Item {index}: '{name}' must be a string")
+
+
+def get_since_arg():
+    """Parse the optional ISO 8601 `since` query parameter."""
+    since = request.args.get("since")
+    if not since:
+        return None
+    try:
+        return datetime.fromisoformat(since)
+    except ValueError as e:
+        raise ValueError("'since' must be an ISO 8601 datetime") from e
+
+
+def get_fields_arg(allowed):
+    """Parse the optional comma separated `fields` query parameter."""
+    fields = request.args.get("fields")
+    if not fields:
+        return None
+    fields = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = set(fields) - set(allowed)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return fields
@@ -0,0 +1,113 @@
+"""
+Cold start benchmark of manage.lambda_handler.
+
+Each run starts a fresh interpreter that imports manage.py as Lambda would,
+then feeds a fake API Gateway event to the handler twice: the first call is
+the cold request (it builds the app), the second a warm one. Times are in
+milliseconds.
+
+    python scripts/bench_cold_start.py --runs 10
+    python scripts/bench_cold_start.py --runs 10 --path /health
+
+The default path, /auth/authenticate, needs no database; /health and the
+other routes that query MongoDB need MONGO_URI to point at a reachable server.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import manage
+imported = time.perf_counter()
+event = json.loads(sys.argv[1])
+status = manage.lambda_handler(event, None)["statusCode"]
+first = time.perf_counter()
+manage.lambda_handler(event, None)
+warm = time.perf_counter()
+print(json.dumps({
+    "status": status,
+    "import_ms": 1000 * (imported - started),
+    "first_request_ms": 1000 * (first - imported),
+    "warm_request_ms": 1000 * (warm - first),
+}))
+"""
+
+
+def api_gateway_event(method, path, token=None):
+    path, _, query = path.partition("?")
+    headers = {
+        "Host": "localhost",
+        "Accept": "application/json",
+        "X-Forwarded-For": "127.0.0.1",
+        "X-Forwarded-Port": "443",
+        "X-Forwarded-Proto": "https",
+    }
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    return {
+        "resource": "/{proxy+}",
+        "path": path,
+        "httpMethod": method,
+        "headers": headers,
+        "multiValueHeaders": {k: [v] for k, v in headers.items()},
+        "queryStringParameters": (
+            dict(p.split("=", 1) for p in query.split("&")) if query else None
+        ),
+        "pathParameters": {"proxy": path.lstrip("/")},
+        "requestContext": {
+            "resourcePath": "/{proxy+}",
+            "httpMethod": method,
+            "path": path,
+            "stage": "bench",
+            "identity": {"sourceIp": "127.0.0.1"},
+        },
+        "body": None,
+        "isBase64Encoded": False,
+    }
+
+
+def run_once(event):
+    env = dict(os.environ, AWS_LAMBDA_FUNCTION_NAME="bench-cold-start")
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD, json.dumps(event)],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if out.returncode:
+        sys.exit(out.stderr)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--method", default="GET")
+    parser.add_argument("--path", default="/auth/authenticate")
+    parser.add_argument("--token", help="Bearer token sent with the request")
+    args = parser.parse_args()
+
+    event = api_gateway_event(args.method, args.path, args.token)
+    runs = [run_once(event) for _ in range(args.runs)]
+    report = {"path": args.path, "runs": args.runs, "status": runs[-1]["status"]}
+    for key in ("import_ms", "first_request_ms", "warm_request_ms"):
+        values = [run[key] for run in runs]
+        report[key] = {
+            "median": round(statistics.median(values), 2),
+            "min": round(min(values), 2),
+            "max": round(max(values), 2),
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
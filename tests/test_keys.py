@@ -0,0 +1,34 @@
+import base64
+import json
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import ed25519
+
+from project.keys import KeyRing, SigningKey
+
+
+@pytest.fixture
+def keyring():
+    keyring = KeyRing()
+    keyring.secret = "secret"
+    keyring.active = SigningKey("2026-01", ed25519.Ed25519PrivateKey.generate())
+    keyring.keys = {keyring.active.kid: keyring.active}
+    return keyring
+
+
+def test_decode_with_the_named_key(keyring):
+    assert keyring.decode(keyring.encode({"sub": "1"})) == {"sub": "1"}
+
+
+def _segment(data):
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+
+
+@pytest.mark.parametrize("kid", [["2026-01"], {"kid": "2026-01"}, 1])
+def test_decode_rejects_a_kid_that_is_not_a_string(keyring, kid):
+    # jwt.encode refuses such a kid, so the token is put together by hand
+    header = {"alg": "EdDSA", "typ": "JWT", "kid": kid}
+    token = f"{_segment(header)}.{_segment({'sub': '1'})}.c2ln"
+    with pytest.raises(jwt.InvalidTokenError):
+        keyring.decode(token)